@@ -36,6 +36,15 @@ import dgl
 from dgl.dataloading import GraphDataLoader
 import copy
 from dgl.nn import EGATConv
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.dataset import split_fold, read_folds, has_schema, partition_feather
+from common.clips import ClipReader
+from common.codecs import read_image
+from common.render import RenderSpec, CropRenderer
+from common.frames import VideoFrameSource, FrameStore
+from common.frame_index import FrameIndex, FRAME_INDEX_NAME, frame_keys_from_files
+from common.items import build_items, load_or_build_items, NegativeSampler, PlayBatchSampler
 
 debug = False
 torch.backends.cudnn.benchmark = True
@@ -132,7 +141,7 @@ class ConfigForTransformer:
     num_layer_transformer: int = 2
     nhead: int = 8
     num_layer_rnn: int = 1
-    feature_dir: str = "../../output/preprocess/feature/exp017/feature_len13876756.feather"
+    feature_dir: str = "../../output/preprocess/feature/exp017/feature_len13876756"  # partitioned (common.dataset)
     max_length: int = 256
     apply_log1p: bool = True
     apply_norm: bool = False
@@ -248,7 +257,7 @@ class Config:
     feature_mean_dim: str = "window"
     nhead: int = 8
     num_layer_transformer: int = 2
-    feature_dir: str = "../../output/preprocess/feature/exp017/feature_len13876756.feather"
+    feature_dir: str = "../../output/preprocess/feature/exp017/feature_len13876756"  # partitioned (common.dataset)
 
     save_feature: bool = False
     interpolate_outside: bool = True
@@ -271,6 +280,31 @@ class Config:
     smooth: float = 0.1
     focal_gamma: float = 2.0
 
+    # base_dir/image_path holds packed clips (common.clips) instead of one jpg per frame
+    packed_clips: bool = False
+
+    # render the crops at read time from the videos + crop geometry (common.crop_geometry) instead of base_dir/image_path
+    render_on_the_fly: bool = False
+    video_dir: str = "../../input/nfl-player-contact-detection/train"
+    # frames from a full frame store (common.frames.FrameStore, preprocess/out_full_image.py) instead of video_dir
+    frame_store_dir: str = ""
+    crop_geometry_dir: str = ""
+    render_spec: RenderSpec = RenderSpec(output_dir="")
+    # full video frames cached per DataLoader worker (1280x720x3 = 2.8MB each, x2 with pack_original): both views of two items.
+    # render_on_the_fly trains on batches of one play in frame order (PlayBatchSampler), so consecutive items hit it
+    frame_cache_size: int = 128
+
+    # images rendered single channel (RenderSpec.grayscale): decoded as grayscale, no per read conversion
+    stored_grayscale: bool = False
+    # channel_6 images rendered as one (H, W, 6) array (RenderSpec.pack_original) instead of _original / _filter files
+    packed_channels: bool = False
+
+    # NFLDataset items cached by input data + image tree + item parameters (common.items.load_or_build_items), "": off
+    item_cache_dir: str = "../../output/cache/items"
+    # train items hold every negative, NegativeSampler draws negative_sample_ratio_* of them per epoch
+    # (the train dataset is built once instead of every epoch)
+    resample_negatives: bool = False
+
 
 class FocalLoss(nn.Module):
     def __init__(self, reduction='mean', alpha=1, gamma=2):
@@ -358,8 +392,15 @@ class NFLDatasetForFeatureExtraction(Dataset):
     def __init__(self, base_dir):
         self.base_dir = base_dir
         filelist_path = f"{self.base_dir}/filelist.pickle"
-        with open(filelist_path, "rb") as f:
-            self.files = list(pickle.load(f))
+        if os.path.isfile(filelist_path):
+            with open(filelist_path, "rb") as f:
+                self.files = list(pickle.load(f))
+        else:
+            keys = FrameIndex.load(f"{self.base_dir}/{FRAME_INDEX_NAME}").keys()
+            self.files = [
+                f"{self.base_dir}/{game_play}/{view}/{id_1}_{id_2}_{frame}.jpg"
+                for game_play, view, id_1, id_2, frame in keys.values
+            ]
 
     def __len__(self):
         return len(self.files)
@@ -534,38 +575,54 @@ class NFLDataset(Dataset):
         self.exist_files = set()
         self.image_dict = image_dict
         self.submission_mode = submission_mode
+        if self.config.packed_clips:
+            self.clip_reader = ClipReader(self.base_dir)
+        else:
+            self.clip_reader = None
+        if self.config.render_on_the_fly:
+            self.crop_renderer = CropRenderer(
+                self.config.crop_geometry_dir,
+                FrameStore(self.config.frame_store_dir) if self.config.frame_store_dir else
+                VideoFrameSource(self.config.video_dir),
+                self.config.render_spec,
+                frame_cache_size=self.config.frame_cache_size,
+            )
+        else:
+            self.crop_renderer = None
 
-        filelist_path = f"{self.base_dir}/filelist.pickle"
+        frame_index_path = f"{self.base_dir}/{FRAME_INDEX_NAME}"
         if use_filelist:
-            if os.path.isfile(filelist_path):
-                logger.info("load filelist...")
-                with open(filelist_path, "rb") as f:
-                    filelist = pickle.load(f)
+            if self.crop_renderer is not None:
+                logger.info("make frame index from crop geometry...")
+                frame_index = FrameIndex.from_keys(self.crop_renderer.frame_keys())
+            elif self.clip_reader is not None:
+                logger.info("make frame index from clip index...")
+                frame_index = FrameIndex.from_keys(self.clip_reader.frame_keys())
+            elif FrameIndex.exists_on_disk(frame_index_path):
+                logger.info("load frame index...")
+                frame_index = FrameIndex.load(frame_index_path)
             else:
-                logger.info("make filelist...")
-                filelist = glob.glob(f"{self.base_dir}/*/*/*{self.config.extention}")
-                filelist = [f.replace("\\", "/") for f in filelist]
-                filelist = set(filelist)
-                logger.info("save filelist...")
-                with open(filelist_path, "wb") as f:
-                    pickle.dump(filelist, f)
+                logger.info("make frame index...")
+                frame_index = FrameIndex.from_keys(frame_keys_from_files(self.base_dir, self.config.extention))
+                logger.info("save frame index...")
+                frame_index.save(frame_index_path)
         else:
-            filelist = None
+            frame_index = None
 
         if not self.submission_mode:
-            self.filelist = filelist
+            self.frame_index = frame_index
         if self.config.channel_6:
             C = 6
         else:
             C = 3
         if self.config.model_name == "cnn_2d3d":
             logger.info("load features...")
-            self.img_shape = np.load(list(filelist)[0]).shape
+            self.img_shape = np.load(self._get_key(*frame_index.first_key())).shape
         elif "2.5d" not in self.config.model_name:
             self.img_shape = (self.config.img_shape[0], self.config.img_shape[1], C)
         else:
             self.img_shape = (self.config.img_shape[0], self.config.img_shape[1], 1)
-        self._get_item_information(df, logger, filelist)
+        self._get_item_information(df, logger, frame_index)
 
     def _get_base_dir(self,
                       game_play: str,
@@ -585,7 +642,7 @@ class NFLDataset(Dataset):
             return f"{game_play}_{view}_{id_1}_{id_2}_{frame}"
         else:
             base_dir = self._get_base_dir(game_play, view, id_1, id_2)
-            if self.config.channel_6:
+            if self.config.channel_6 and not self.config.packed_channels:
                 return f"{base_dir}_{frame}{prefix}{self.config.extention}"
             else:
                 return f"{base_dir}_{frame}{self.config.extention}"
@@ -596,7 +653,7 @@ class NFLDataset(Dataset):
                     id_1,
                     id_2,
                     frame,
-                    filelist):
+                    frame_index):
         if self.config.channel_6:
             prefix = "_original"
         else:
@@ -606,162 +663,79 @@ class NFLDataset(Dataset):
             return self._get_key(game_play, view, id_1, id_2, frame, prefix) in self.image_dict
         else:
             # for local training
-            return self._get_key(game_play, view, id_1, id_2, frame, prefix) in filelist
-
-    def _exist_files(self,
-                     game_play: str,
-                     id_1: str,
-                     id_2: str,
-                     frames: List[int],
-                     filelist: set,
-                     n_frames: int,
-                     exist_image_threshold: float):
-        count = 0
+            return frame_index.contains(game_play, view, id_1, id_2, frame)
 
+    def _count_exist_files(self,
+                           pairs: pd.DataFrame,
+                           pair_idx: np.ndarray,
+                           frames: np.ndarray,
+                           frame_index: FrameIndex):
+        """
+        number of existing images of both views of every row (frames: (n, F), pair_idx: row of `pairs`).
+        """
+        game_plays = pairs["game_play"].values
+        id_1s = pairs["nfl_player_id_1"].values
+        id_2s = pairs["nfl_player_id_2"].values
+        count = np.zeros(len(frames), dtype=np.int64)
         for view in ["Sideline", "Endzone"]:
-            base_dir = self._get_base_dir(game_play, view, id_1, id_2)
-            for frame in frames:
-                if self._exist_file(game_play, view, id_1, id_2, frame, filelist):
-                    count += 1
-                if count >= n_frames * 2 * exist_image_threshold:
-                    return True
-        return False
-
-    def _get_item_information(self, df: pd.DataFrame, logger: Logger, filelist: set):
-        self.items = []
-        logger.info("_get_item_information start")
-
-        failed_count = 0
-        is_g_count = 0
-        np.random.seed(0)
-
-        contacts_all = []
-        df = df[df["contact"].notnull()]
-
-        if self.config.only_g:
-            df = df[df["nfl_player_id_2"] == "G"]
-        if self.config.feature_window > 0:
-            cols_log = [f"{col}_log" for col in self.config.feature_cols]
-            df[cols_log] = np.log1p(df[self.config.feature_cols].fillna(0)).replace(np.inf, 0).replace(-np.inf, 0).fillna(0)
-        for key, w_df in tqdm.tqdm(
-            df.drop_duplicates(
-                ["game_play", "nfl_player_id_1", "nfl_player_id_2", "step"]
-            ).groupby(
-                ["game_play", "nfl_player_id_1", "nfl_player_id_2"]
-            )
-        ):
-            game_play = key[0]
-            id_1 = key[1]
-            id_2 = key[2]
-            w_df = w_df.reset_index(drop=True)
-
-            contact_ids = w_df["contact_id"].values
-            frames = w_df["frame"].values
-            contacts = w_df["contact"].values
-            distances = w_df["distance"].fillna(0).values
-
-            if self.config.feature_window > 0:
-                features = w_df[cols_log].values
-
-            for i in range(len(w_df)):
-
-                is_g = int(id_2 == "G")
-                if not self.test and i % self.config.use_data_step != 0:
-                    continue
-
-                min_frame_idx = frames[i] - self.config.n_frames // 2 * self.config.step
-                max_frame_idx = frames[i] + self.config.n_frames // 2 * self.config.step + 1  # frames数は偶数にする(conv1dメンドイので)
-
-                frame_indice = np.arange(min_frame_idx, max_frame_idx, self.config.step)
-
-                if self.config.frame_adjust > 0 and not self.test:
-                    frame_index_adjust = int(np.random.choice(np.arange(-self.config.frame_adjust, self.config.frame_adjust+1)))
-                    frame_indice += frame_index_adjust
-                window = self.config.n_predict_frames // 2
-
-                if i - window < 0 or i + window + 1 > len(w_df):
-                    continue
-                predict_frames_indice = np.arange(
-                    i - window,
-                    i + window + 1,
-                )
-
-                if self.config.feature_window > 0:
-                    feature_window = self.config.feature_window // 2
-                    feature_indices = np.arange(
-                        max(i - feature_window, 0),
-                        min(i + feature_window + 1, len(w_df))
+            if self.image_dict is None:
+                groups = frame_index.group_ids(game_plays, [view] * len(pairs), id_1s, id_2s)
+                count += frame_index.exists_at(groups[pair_idx, np.newaxis], frames).sum(axis=1)
+            else:
+                for k, (idx, frames_) in enumerate(zip(pair_idx, frames)):
+                    count[k] += sum(
+                        self._exist_file(game_plays[idx], view, id_1s[idx], id_2s[idx], frame, frame_index)
+                        for frame in frames_
                     )
-                    feature = features[feature_indices]
-
-                    if i - feature_window < 0:
-                        feature = np.concatenate([
-                            np.zeros((feature_window - i, len(self.config.feature_cols))) - 1,
-                            feature
-                        ], axis=0)
-                    if i + feature_window + 1 > len(w_df):
-                        feature = np.concatenate([
-                            feature,
-                            np.zeros((feature_window + i + 1 - len(w_df), len(self.config.feature_cols))) - 1
-                        ], axis=0)
-                    assert feature.shape == (self.config.feature_window, len(self.config.feature_cols))
-                else:
-                    feature = [0]
-
-                assert len(predict_frames_indice) == self.config.n_predict_frames
-                if distances[predict_frames_indice].min() > self.config.distance_threshold:
-                    continue
-
-                if not self.test and contacts[predict_frames_indice].sum() == 0:
-                    # down sampling (only negative)
-                    if not is_g:
-                        if distances[i] < 0.75 and np.random.random() > self.config.negative_sample_ratio_close:
-                            continue
-                        if distances[i] >= 0.75 and np.random.random() > self.config.negative_sample_ratio_far:
-                            continue
-                    elif is_g and np.random.random() > self.config.negative_sample_ratio_g:
-                        continue
-
-                if not self._exist_files(game_play=game_play, id_1=id_1, id_2=id_2, frames=frame_indice,
-                                         filelist=filelist, n_frames=self.config.n_frames,
-                                         exist_image_threshold=self.config.exist_image_threshold):
-                    failed_count += 1
-                    continue
-                if not self._exist_files(game_play=game_play, id_1=id_1, id_2=id_2,
-                                         frames=frames[predict_frames_indice], filelist=filelist,
-                                         n_frames=self.config.n_predict_frames,
-                                         exist_image_threshold=self.config.exist_center_image_threshold):
-                    failed_count += 1
-                    continue
-
-                contacts_ = contacts[predict_frames_indice]
-                if self.config.soft_label_range is not None and not self.test:
-                    contacts_ = np.clip(contacts_, self.config.soft_label_range[0], self.config.soft_label_range[1])
+        return count
 
-                contacts_all.append({
-                    "is_g": is_g,
-                    "contact": contacts_.mean()
-                })
-
-                self.items.append({
-                    "contact_id": contact_ids[predict_frames_indice],
-                    "game_play": game_play,
-                    "id_1": id_1,
-                    "id_2": id_2,
-                    "contact": contacts_,
-                    "frames": frame_indice,
-                    "features": feature,
-                    "is_g": is_g,
-                })
-                is_g_count += is_g
+    def _get_item_information(self, df: pd.DataFrame, logger: Logger, frame_index: FrameIndex):
+        logger.info("_get_item_information start")
+        params = dict(
+            n_frames=self.config.n_frames,
+            step=self.config.step,
+            n_predict_frames=self.config.n_predict_frames,
+            distance_threshold=self.config.distance_threshold,
+            exist_image_threshold=self.config.exist_image_threshold,
+            exist_center_image_threshold=self.config.exist_center_image_threshold,
+            use_data_step=self.config.use_data_step,
+            frame_adjust=self.config.frame_adjust,
+            negative_sample_ratio_close=self.config.negative_sample_ratio_close,
+            negative_sample_ratio_far=self.config.negative_sample_ratio_far,
+            negative_sample_ratio_g=self.config.negative_sample_ratio_g,
+            soft_label_range=self.config.soft_label_range,
+            feature_window=self.config.feature_window,
+            feature_cols=self.config.feature_cols,
+            only_g=self.config.only_g,
+            test=self.test,
+            seed=0,
+        )
+        if self.config.resample_negatives and not self.test:
+            # candidate pool, negatives are drawn per epoch (NegativeSampler)
+            params.update(negative_sample_ratio_close=1, negative_sample_ratio_far=1, negative_sample_ratio_g=1)
+        count_exist = lambda pairs, pair_idx, frames: self._count_exist_files(pairs, pair_idx, frames, frame_index)
+        if self.config.item_cache_dir and self.image_dict is None and frame_index is not None:
+            items, stats = load_or_build_items(
+                self.config.item_cache_dir, df, count_exist, exist_fingerprint=frame_index.fingerprint(), **params
+            )
+        else:
+            items, stats = build_items(df, count_exist, **params)
+        self.items = items
 
-        logger.info(f"finished. extracted={len(self.items)} (total={len(df)}, is_g={is_g_count}, failed={failed_count})")
-        logger.info(f"contacts_distribution: \n {pd.DataFrame(contacts_all).groupby(['is_g', 'contact']).size()}")
+        logger.info(f"finished. extracted={len(self.items)} (total={stats['total']}, is_g={stats['is_g']}, failed={stats['failed']})")
+        contacts_all = pd.DataFrame({"is_g": items.is_g, "contact": items.contact().mean(axis=1)})
+        logger.info(f"contacts_distribution: \n {contacts_all.groupby(['is_g', 'contact']).size()}")
 
     def __len__(self):
         return len(self.items)
 
+    def _packed_source(self):
+        # clips / render_on_the_fly: one record per frame holding all channels, existence is known by the source
+        return self.image_dict is None and (self.crop_renderer is not None or self.clip_reader is not None)
+
     def imread_6channel(self, game_play, view, id_1, id_2, frame):
+        if self.config.packed_channels or self._packed_source():
+            return self.imread(game_play, view, id_1, id_2, frame)
         if self.imread(game_play, view, id_1, id_2, frame, prefix="_original") is None:
             return None
         return np.concatenate([
@@ -770,12 +744,16 @@ class NFLDataset(Dataset):
         ], axis=2)
 
     def imread(self, game_play, view, id_1, id_2, frame, prefix=""):
+        if self._packed_source():
+            if self.crop_renderer is not None:
+                return self.imread_rendered(game_play, view, id_1, id_2, [frame])[0]
+            return self.imread_clip(game_play, view, id_1, id_2, [frame])[0]
         key = self._get_key(game_play, view, id_1, id_2, frame, prefix)
         # random drop frame
         if np.random.random() < self.config.p_drop_frame and not self.test:
             return None
         if not self.submission_mode:
-            isfile = key in self.filelist
+            isfile = self.frame_index.contains(game_play, view, id_1, id_2, frame)
         elif self.image_dict is not None:
             isfile = key in self.image_dict
         else:
@@ -785,10 +763,42 @@ class NFLDataset(Dataset):
                 return self.image_dict[key]
             if self.config.extention == ".npy":
                 img = np.load(key)
-            if self.config.extention == ".jpg":
-                img = cv2.imread(key)
+            elif self.config.extention == ".jpg":
+                img = cv2.imread(key, self._imread_flags())
+            else:
+                img = read_image(key, self._imread_flags())
         else:
             return None
+        return self._convert(img)
+
+    def imread_clip(self, game_play, view, id_1, id_2, frames):
+        """
+        imread of every frame of the window with one read from the packed clips.
+        """
+        drop = [np.random.random() < self.config.p_drop_frame and not self.test for _ in frames]
+        imgs = self.clip_reader.read(game_play, view, id_1, id_2, frames, flags=self._imread_flags())
+        return [None if drop[i] or img is None else self._convert(img) for i, img in enumerate(imgs)]
+
+    def imread_rendered(self, game_play, view, id_1, id_2, frames):
+        """
+        imread of every frame of the window, rendered from the video frames (render_on_the_fly).
+        """
+        drop = [np.random.random() < self.config.p_drop_frame and not self.test for _ in frames]
+        imgs = self.crop_renderer.render(game_play, view, id_1, id_2, frames)
+        return [None if drop[i] or img is None else self._convert(img) for i, img in enumerate(imgs)]
+
+    def _imread_flags(self):
+        if self.config.stored_grayscale:
+            return cv2.IMREAD_GRAYSCALE
+        return cv2.IMREAD_COLOR
+
+    def _convert(self, img):
+        if img.ndim == 2:
+            # stored grayscale
+            img = img[:, :, np.newaxis]
+            if "2.5d" not in self.config.model_name:
+                img = np.concatenate([img, img, img], axis=2)
+            return img
         if self.config.grayscale or "2.5d" in self.config.model_name:
             img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)[:, :, np.newaxis]
             if "2.5d" not in self.config.model_name:
@@ -820,7 +830,11 @@ class NFLDataset(Dataset):
 
         imgs_all = []
         for view in ["Endzone", "Sideline"]:
-            if self.config.channel_6:
+            if self.crop_renderer is not None and self.image_dict is None:
+                imgs = self.imread_rendered(game_play, view, id_1, id_2, frames)
+            elif self.clip_reader is not None and self.image_dict is None:
+                imgs = self.imread_clip(game_play, view, id_1, id_2, frames)
+            elif self.config.channel_6:
                 imgs = [self.imread_6channel(game_play, view, id_1, id_2, frame) for frame in frames]
             else:
                 imgs = [self.imread(game_play, view, id_1, id_2, frame) for frame in frames]
@@ -2035,6 +2049,37 @@ class Model3D(nn.Module):
             return self._forward_concat_sideend(x, is_g, feature)
 
 
+def make_negative_sampler(dataset, config):
+    if type(config) != Config or not config.resample_negatives:
+        return None
+    return NegativeSampler(
+        dataset.items,
+        negative_sample_ratio_close=config.negative_sample_ratio_close,
+        negative_sample_ratio_far=config.negative_sample_ratio_far,
+        negative_sample_ratio_g=config.negative_sample_ratio_g,
+    )
+
+
+def make_train_loader(dataset, config, num_workers, sampler=None):
+    if type(config) == Config and config.render_on_the_fly:
+        # batches of one play in frame order: the rendered frames are reused inside a worker (common.render.CropRenderer)
+        return DataLoader(
+            dataset,
+            batch_sampler=PlayBatchSampler(dataset.items, batch_size=config.batch_size, sampler=sampler, drop_last=True),
+            pin_memory=True,
+            num_workers=num_workers
+        )
+    return DataLoader(
+        dataset,
+        batch_size=config.batch_size,
+        shuffle=sampler is None,
+        sampler=sampler,
+        pin_memory=True,
+        drop_last=True,
+        num_workers=num_workers
+    )
+
+
 def get_df_from_item(item):
     df = pd.DataFrame({
         "contact_id": item["contact_id"],
@@ -2076,8 +2121,6 @@ def main(config):
         base_dir = config.base_dir
         logger = get_logger(output_dir)
         logger.info("start!")
-        df = pd.read_feather(config.feature_dir)
-        gkfold = GroupKFold(5)
 
         df_label = pd.read_csv("../../input/nfl-player-contact-detection/train_labels.csv")
         if config.debug:
@@ -2103,19 +2146,21 @@ def main(config):
             raise ValueError("モデルの指定が変です")
 
         df_label["game_key"] = [int(x.split("_")[0]) for x in df_label["contact_id"].values]
-        for fold, (train_idx, val_idx) in enumerate(gkfold.split(df_label, groups=df_label[config.gk_key].values)):
-            if fold != config.fold:
-                continue
-            df_label_train = df_label.iloc[train_idx]
-            df_label_val = df_label.iloc[val_idx]
-            if type(config) == ConfigForTransformer:
-                df_feature = pd.read_feather(config.feature_dir)
-                df_train = df_feature[df_feature["game_play"].isin(df_label_train["game_play"].values)]
-                df_val = df_feature[df_feature["game_play"].isin(df_label_val["game_play"].values)]
-            else:
-                df_train = df[df[config.gk_key].isin(df_label_train[config.gk_key].values)]
-                df_val = df[df[config.gk_key].isin(df_label_val[config.gk_key].values)]
-            break
+        # read only the partitions of this fold
+        if not has_schema(config.feature_dir) and os.path.isfile(f"{config.feature_dir}.feather"):
+            # lgbm/exp017 writes a single feather file: partition it once
+            # (again for directories partitioned before the row order / schema were kept)
+            partition_feather(f"{config.feature_dir}.feather", config.feature_dir)
+        df_label_train, df_label_val = split_fold(df_label, fold=config.fold, key=config.gk_key)
+        if type(config) == ConfigForTransformer:
+            df_train, df_val = read_folds(
+                config.feature_dir, "game_play", [df_label_train["game_play"].values, df_label_val["game_play"].values]
+            )
+        else:
+            df_train, df_val = read_folds(
+                config.feature_dir, config.gk_key, [df_label_train[config.gk_key].values, df_label_val[config.gk_key].values]
+            )
+        df = pd.concat([df_train[["contact_id", "contact"]], df_val[["contact_id", "contact"]]])
         df_merge = pd.merge(
             df_label[["contact_id", "contact"]],
             df[["contact_id", "contact"]].rename(columns={"contact": "pred"}),
@@ -2188,14 +2233,8 @@ def main(config):
             if config.debug:
                 train_dataset.items = train_dataset.items[:200]
                 val_dataset.items = val_dataset.items[:200]
-            train_loader = DataLoader(
-                train_dataset,
-                batch_size=config.batch_size,
-                shuffle=True,
-                pin_memory=True,
-                drop_last=True,
-                num_workers=num_workers
-            )
+            train_sampler = make_negative_sampler(train_dataset, config)
+            train_loader = make_train_loader(train_dataset, config, num_workers, sampler=train_sampler)
 
             val_loader = DataLoader(
                 val_dataset,
@@ -2304,7 +2343,10 @@ def main(config):
             logger.info(f"epoch {epoch + 1}")
             logger.info(f"===============================")
 
-            if type(config) == Config:
+            if type(config) == Config and config.resample_negatives:
+                train_sampler.set_epoch(epoch)
+                logger.info(f"resampled negatives: {len(train_sampler)} / {len(train_dataset)} items")
+            elif type(config) == Config:
                 train_dataset = NFLDataset(
                     df=df_train,
                     base_dir=f"{base_dir}/{config.image_path}",
@@ -2315,14 +2357,9 @@ def main(config):
                 )
                 if config.debug:
                     train_dataset.items = train_dataset.items[:200]
-                train_loader = DataLoader(
-                    train_dataset,
-                    batch_size=config.batch_size,
-                    shuffle=True,
-                    pin_memory=True,
-                    drop_last=True,
-                    num_workers=num_workers
-                )
+                train_loader = make_train_loader(train_dataset, config, num_workers)
+            if isinstance(getattr(train_loader, "batch_sampler", None), PlayBatchSampler):
+                train_loader.batch_sampler.set_epoch(epoch)
 
             train_loss = train_fn(
                 train_loader,
@@ -2345,11 +2382,7 @@ def main(config):
 
             df_label = pd.read_csv("../../input/nfl-player-contact-detection/train_labels.csv")
             df_label["game_key"] = [int(x.split("_")[0]) for x in df_label["contact_id"].values]
-            for fold, (train_idx, val_idx) in enumerate(gkfold.split(df_label, groups=df_label[config.gk_key].values)):
-                if fold != config.fold:
-                    continue
-                df_label_val = df_label.iloc[val_idx]
-                break
+            _, df_label_val = split_fold(df_label, fold=config.fold, key=config.gk_key)
 
             logger.info(f"loss: train {train_loss}, val {valid_loss}")
             logger.info(f"------ MCC ------")
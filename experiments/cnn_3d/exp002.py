@@ -19,6 +19,9 @@ from torchvision.models.video import r3d_18, R3D_18_Weights, r2plus1d_18, R2Plus
 from sklearn.metrics import roc_auc_score, matthews_corrcoef
 import shutil
 import mlflow
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.master_data import load_master_data
 
 def get_logger(output_dir=None, logging_level=logging.INFO):
     formatter = Formatter("%(asctime)s|%(levelname)s| %(message)s")
@@ -304,7 +307,7 @@ def main(config):
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
     base_dir = config.base_dir
-    df = pd.read_feather(f"{base_dir}/data/gps.feather")
+    df = load_master_data(f"{base_dir}/data/gps.feather")
     logger = get_logger(output_dir)
     logger.info("start!")
     gkfold = GroupKFold(5)
@@ -0,0 +1,152 @@
+import cv2
+import numpy as np
+import pandas as pd
+import os
+import glob
+import threading
+import pyarrow as pa
+import pyarrow.feather as feather
+from typing import List
+from .codecs import get_codec
+
+# packed crops of one (game_play, view):
+#   {base_dir}/{game_play}/{view}.bin            encoded images, grouped by pair and sorted by frame
+#   {base_dir}/{game_play}/{view}.index.feather  id_1, id_2, frame, offset, length (written last),
+#                                                 codec name (common.codecs) in the schema metadata
+# a window of frames of one pair is one contiguous byte range of the .bin file.
+BIN_SUFFIX = ".bin"
+INDEX_SUFFIX = ".index.feather"
+
+
+class ClipWriter:
+    """
+    collects the encoded crops of one video (thread safe, any order) and writes them pair by pair on close().
+    crops are appended to {path}.bin.unsorted.tmp as they arrive, only their positions are kept in memory.
+    """
+    def __init__(self, path: str, codec: str = "jpg"):
+        self.path = path
+        self.codec_name = codec
+        self.codec = get_codec(codec)
+        self.lock = threading.Lock()
+        self.records = []
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.unsorted_path = f"{self.path}{BIN_SUFFIX}.unsorted.tmp"
+        self.unsorted = open(self.unsorted_path, "wb")
+        self.unsorted_size = 0
+
+    def add(self, id_1: str, id_2: str, frame: int, buf):
+        buf = np.asarray(buf, dtype=np.uint8).tobytes()
+        with self.lock:
+            self.unsorted.write(buf)
+            self.records.append((str(id_1), str(id_2), int(frame), self.unsorted_size, len(buf)))
+            self.unsorted_size += len(buf)
+
+    def add_image(self, id_1: str, id_2: str, frame: int, img: np.ndarray):
+        self.add(id_1, id_2, frame, np.frombuffer(self.codec.encode(img), dtype=np.uint8))
+
+    def close(self):
+        self.unsorted.close()
+        df = pd.DataFrame(self.records, columns=["id_1", "id_2", "frame", "unsorted_offset", "length"])
+        df = df.sort_values(["id_1", "id_2", "frame"]).reset_index(drop=True)
+        lengths = df["length"].values.astype(np.int64)
+        df["offset"] = (np.cumsum(lengths) - lengths).astype(np.int64)
+        df["length"] = lengths.astype(np.int32)
+        df["frame"] = df["frame"].astype(np.int32)
+
+        # reorder: arrival order -> pair by pair
+        with open(self.unsorted_path, "rb") as src, open(f"{self.path}{BIN_SUFFIX}.tmp", "wb") as f:
+            for unsorted_offset, length in zip(df["unsorted_offset"].values, lengths):
+                src.seek(unsorted_offset)
+                f.write(src.read(length))
+        os.replace(f"{self.path}{BIN_SUFFIX}.tmp", f"{self.path}{BIN_SUFFIX}")
+        os.remove(self.unsorted_path)
+        df = df[["id_1", "id_2", "frame", "offset", "length"]]
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"codec": self.codec_name.encode()})
+        feather.write_feather(table, f"{self.path}{INDEX_SUFFIX}.tmp")
+        os.replace(f"{self.path}{INDEX_SUFFIX}.tmp", f"{self.path}{INDEX_SUFFIX}")
+        self.records = []
+        return len(df)
+
+
+class ClipReader:
+    """
+    random access to the packed crops written by ClipWriter.
+    read(): the frames of one pair with a single seek + read (frames outside the stored range cost nothing).
+    """
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self.indices = {}
+        self.codecs = {}
+
+    def videos(self):
+        ret = []
+        for path in sorted(glob.glob(f"{self.base_dir}/*/*{INDEX_SUFFIX}")):
+            path = path.replace("\\", "/")
+            ret.append((path.split("/")[-2], os.path.basename(path)[:-len(INDEX_SUFFIX)]))
+        return ret
+
+    def index(self, game_play: str, view: str):
+        """
+        {(id_1, id_2): (frames, offsets, lengths)} of one video, empty if the video has no crops.
+        """
+        key = (game_play, view)
+        if key not in self.indices:
+            path = f"{self.base_dir}/{game_play}/{view}{INDEX_SUFFIX}"
+            index = {}
+            self.codecs[key] = get_codec("jpg")
+            if os.path.isfile(path):
+                table = feather.read_table(path)
+                self.codecs[key] = get_codec((table.schema.metadata or {}).get(b"codec", b"jpg").decode())
+                df = table.to_pandas()
+                for pair, w_df in df.groupby(["id_1", "id_2"]):
+                    index[pair] = (w_df["frame"].values, w_df["offset"].values, w_df["length"].values)
+            self.indices[key] = index
+        return self.indices[key]
+
+    def frame_keys(self):
+        """
+        game_play, view, id_1, id_2, frame of every stored crop (common.frame_index.FrameIndex.from_keys).
+        """
+        dfs = []
+        for game_play, view in self.videos():
+            df = feather.read_feather(f"{self.base_dir}/{game_play}/{view}{INDEX_SUFFIX}", columns=["id_1", "id_2", "frame"])
+            df["game_play"] = game_play
+            df["view"] = view
+            dfs.append(df)
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=["game_play", "view", "id_1", "id_2", "frame"])
+        return pd.concat(dfs, ignore_index=True)
+
+    def read_buffers(self, game_play: str, view: str, id_1: str, id_2: str, frames):
+        """
+        encoded bytes of every frame in `frames` (None if not stored).
+        """
+        ret = [None] * len(frames)
+        index = self.index(game_play, view).get((str(id_1), str(id_2)))
+        if index is None:
+            return ret
+        stored_frames, offsets, lengths = index
+        frames = np.asarray(frames, dtype=np.int64)
+        pos = np.clip(np.searchsorted(stored_frames, frames), 0, len(stored_frames) - 1)
+        found = stored_frames[pos] == frames
+        if not found.any():
+            return ret
+
+        start = offsets[pos[found]].min()
+        end = (offsets[pos[found]] + lengths[pos[found]]).max()
+        with open(f"{self.base_dir}/{game_play}/{view}{BIN_SUFFIX}", "rb") as f:
+            f.seek(start)
+            buf = f.read(end - start)
+        for i in np.where(found)[0]:
+            offset = offsets[pos[i]] - start
+            ret[i] = buf[offset:offset + lengths[pos[i]]]
+        return ret
+
+    def read(self, game_play: str, view: str, id_1: str, id_2: str, frames, flags=cv2.IMREAD_COLOR):
+        """
+        decoded images (same pixels as reading the loose file), None where the frame is not stored.
+        """
+        bufs = self.read_buffers(game_play, view, id_1, id_2, frames)
+        codec = self.codecs[(game_play, view)]
+        return [None if buf is None else codec.decode(buf, flags) for buf in bufs]
@@ -0,0 +1,107 @@
+import cv2
+import io
+import numpy as np
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# storage codecs of rendered crops. a codec is named "name[:param]":
+#   jpg[:quality]  cv2 jpeg, quality 0-100 (95 = cv2.imwrite default)
+#   png[:level]    cv2 png, lossless, compression level 0-9 (1: fast)
+#   npy            raw uint8 array (.npy, no decode cost)
+#   lz4            raw uint8 array compressed with lz4 (lossless, registered only when the lz4 package is importable)
+
+
+class JpegCodec:
+    ext = ".jpg"
+    lossless = False
+
+    def __init__(self, quality: int = 95):
+        self.quality = int(quality)
+
+    def encode(self, img: np.ndarray):
+        return cv2.imencode(self.ext, img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+    def decode(self, buf: bytes, flags=cv2.IMREAD_UNCHANGED):
+        return cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), flags)
+
+    def read(self, path: str, flags=cv2.IMREAD_UNCHANGED):
+        return cv2.imread(path, flags)
+
+
+class PngCodec(JpegCodec):
+    ext = ".png"
+    lossless = True
+
+    def __init__(self, level: int = 1):
+        self.level = int(level)
+
+    def encode(self, img: np.ndarray):
+        return cv2.imencode(self.ext, img, [cv2.IMWRITE_PNG_COMPRESSION, self.level])[1].tobytes()
+
+
+class NpyCodec:
+    ext = ".npy"
+    lossless = True
+
+    def encode(self, img: np.ndarray):
+        f = io.BytesIO()
+        np.save(f, np.ascontiguousarray(img))
+        return f.getvalue()
+
+    def decode(self, buf: bytes, flags=None):
+        return np.load(io.BytesIO(buf))
+
+    def read(self, path: str, flags=None):
+        return np.load(path)
+
+
+class Lz4Codec(NpyCodec):
+    ext = ".npy.lz4"
+
+    def encode(self, img: np.ndarray):
+        return lz4.frame.compress(super().encode(img))
+
+    def decode(self, buf: bytes, flags=None):
+        return super().decode(lz4.frame.decompress(buf))
+
+    def read(self, path: str, flags=None):
+        with open(path, "rb") as f:
+            return self.decode(f.read())
+
+
+CODECS = {
+    "jpg": JpegCodec,
+    "png": PngCodec,
+    "npy": NpyCodec,
+}
+if lz4 is not None:
+    CODECS["lz4"] = Lz4Codec
+
+
+def get_codec(name: str = "jpg"):
+    """
+    "jpg:90" -> JpegCodec(90)
+    """
+    name, *params = name.split(":")
+    if name not in CODECS:
+        raise ValueError(f"unknown codec {name} ({list(CODECS.keys())})")
+    return CODECS[name](*params)
+
+
+def get_codec_by_ext(path: str):
+    for name in sorted(CODECS.keys(), key=lambda x: -len(CODECS[x].ext)):
+        if path.endswith(CODECS[name].ext):
+            return CODECS[name]()
+    return None
+
+
+def read_image(path: str, flags=cv2.IMREAD_COLOR):
+    """
+    read a rendered crop of any codec (by extension).
+    """
+    codec = get_codec_by_ext(path)
+    if codec is None:
+        return cv2.imread(path, flags)
+    return codec.read(path, flags)
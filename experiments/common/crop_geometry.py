@@ -0,0 +1,180 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import hashlib
+import tqdm
+from typing import List
+from .helmets import densify_helmets
+
+# bump when the join / geometry logic changes -> cache is rebuilt
+CROP_GEOMETRY_VERSION = "v1"
+
+GEOMETRY_COLUMNS = [
+    "game_play", "view", "step", "frame", "nfl_player_id_1", "nfl_player_id_2", "contact",
+    "x", "y", "width", "height", "bbox_size",
+    "left_1", "top_1", "width_1", "height_1", "team_1",
+    "left_2", "top_2", "width_2", "height_2", "team_2",
+]
+
+
+def join_helmets_frames(game_play, labels, helmets, meta, view="Sideline", fps=59.94):
+    """
+    Joins helmets and labels for a given game_play (all views). Unlike common.helmets.join_helmets_contact
+    every video frame of a NGS step is kept (one row per label x frame), which is what the renderers draw.
+    """
+    gp_labs = labels.query("game_play == @game_play").copy()
+    gp_helms = helmets.query("game_play == @game_play").copy()
+
+    start_time = meta.query("game_play == @game_play and view == @view")[
+        "start_time"
+    ].values[0]
+
+    gp_helms["datetime"] = (
+            pd.to_timedelta(gp_helms["frame"] * (1 / fps), unit="s") + start_time
+    )
+    gp_helms["datetime"] = pd.to_datetime(gp_helms["datetime"], utc=True)
+    gp_helms["datetime_ngs"] = (
+        pd.DatetimeIndex(gp_helms["datetime"] + pd.to_timedelta(50, "ms"))
+            .floor("100ms")
+            .values
+    )
+    gp_helms["datetime_ngs"] = pd.to_datetime(gp_helms["datetime_ngs"], utc=True)
+
+    gp_labs["datetime_ngs"] = pd.to_datetime(gp_labs["datetime"], utc=True)
+
+    keys = ["frame", "game_play", "datetime_ngs", "view"]
+    gp = pd.merge(
+        gp_labs,
+        gp_helms.drop("datetime", axis=1).rename(columns={col: f"{col}_1" for col in gp_helms.columns if col not in keys}),
+        how="left",
+    )
+    gp = pd.merge(
+        gp,
+        gp_helms.drop("datetime", axis=1).rename(columns={col: f"{col}_2" for col in gp_helms.columns if col not in keys}),
+        how="left",
+    )
+    gp["nfl_player_id_2"] = ["G" if "G" in ary[1] else ary[0] for ary in gp[["nfl_player_id_2", "contact_id"]].values]
+    return gp
+
+
+def _file_signature(paths: List[str]):
+    return [(os.path.basename(path), os.path.getsize(path), int(os.path.getmtime(path))) for path in paths]
+
+
+def crop_geometry_key(input_paths: List[str], params: dict):
+    """
+    cache key: input files (name, size, mtime) + join parameters + CROP_GEOMETRY_VERSION
+    """
+    key = {
+        "version": CROP_GEOMETRY_VERSION,
+        "inputs": _file_signature(input_paths),
+        "params": params,
+    }
+    return hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def build_crop_geometry(base_dir: str,
+                        traintest: str,
+                        master_data_path: str,
+                        distance_threshold: float,
+                        interpolate_limit: int):
+    """
+    the preprocessing part of out_image_128x96_v45: distance filter -> helmet interpolation -> join -> crop center/size.
+    yields (game_play, view, df) per (game_play, view).
+    """
+    df_helmets = pd.read_csv(f"{base_dir}/{traintest}_baseline_helmets.csv")
+    df_helmets["x"] = df_helmets["left"] + df_helmets["width"] / 2
+    df_helmets["y"] = df_helmets["top"] + df_helmets["height"] / 2
+    df_helmets["team"] = [x[0] for x in df_helmets["player_label"].values]
+
+    df_labels = pd.read_csv(f"{base_dir}/{traintest}_labels.csv", parse_dates=["datetime"])
+    df_meta = pd.read_csv(f"{base_dir}/{traintest}_video_metadata.csv", parse_dates=["start_time", "end_time", "snap_time"])
+    df_labels["nfl_player_id_1"] = df_labels["nfl_player_id_1"].astype(str)
+    df_helmets["nfl_player_id"] = df_helmets["nfl_player_id"].astype(str)
+
+    print(df_labels["contact"].sum(), len(df_labels))
+
+    if distance_threshold is not None:
+        df_tracking = pd.read_feather(master_data_path)
+        df_tracking["distance"] = [0 if ary[0] == "G" else ary[1] for ary in df_tracking[["nfl_player_id_2", "distance"]].values]
+        df_dist = df_tracking.groupby(["game_play", "nfl_player_id_1", "nfl_player_id_2"])["distance"].min().reset_index()
+        df_labels = pd.merge(df_labels, df_dist[df_dist["distance"] < distance_threshold][["game_play", "nfl_player_id_1", "nfl_player_id_2"]])
+
+        print(df_labels["contact"].sum(), len(df_labels))
+
+    df_helmets_ = df_helmets[[
+        "game_play", "nfl_player_id", "x", "y", "left", "top", "width", "height", "frame", "view", "team"
+    ]]
+    df_helmets = densify_helmets(
+        df_helmets_,
+        keys=["game_play", "view", "nfl_player_id", "team"],
+        interpolate_cols=["x", "y", "left", "top", "width", "height"] if interpolate_limit is not None else [],
+        limit=interpolate_limit,
+    )
+
+    game_plays = df_labels["game_play"].drop_duplicates().values
+    for game_play in tqdm.tqdm(game_plays):
+        gp = join_helmets_frames(game_play, df_labels, df_helmets, df_meta)
+        for col in ["x", "y", "width", "height"]:
+            gp[col] = gp[[f"{col}_1", f"{col}_2"]].mean(axis=1)
+        gp["bbox_size"] = gp[["width", "height"]].mean(axis=1)
+        gp["bbox_size"] = gp.groupby(["view", "step", "game_play"])["bbox_size"].transform("mean")
+        for view in ["Endzone", "Sideline"]:
+            yield game_play, view, gp[gp["view"] == view][GEOMETRY_COLUMNS].reset_index(drop=True)
+
+
+def prepare_crop_geometry(base_dir: str,
+                          traintest: str = "train",
+                          master_data_path: str = "../../output/preprocess/master_data_v3/gps.feather",
+                          distance_threshold: float = 1.5,
+                          interpolate_limit: int = 10,
+                          cache_dir: str = "../../output/preprocess/crop_geometry"):
+    """
+    returns the cache directory holding {game_play}_{view}.feather for every (game_play, view), building it on the first call.
+    renderers with the same inputs / parameters share the cache and can start decoding videos right away.
+    """
+    params = {
+        "traintest": traintest,
+        "distance_threshold": distance_threshold,
+        "interpolate_limit": interpolate_limit,
+    }
+    input_paths = [
+        f"{base_dir}/{traintest}_baseline_helmets.csv",
+        f"{base_dir}/{traintest}_labels.csv",
+        f"{base_dir}/{traintest}_video_metadata.csv",
+    ]
+    if distance_threshold is not None:
+        input_paths.append(master_data_path)
+    output_dir = f"{cache_dir}/{crop_geometry_key(input_paths, params)}"
+    if os.path.isfile(f"{output_dir}/game_plays.json"):
+        print(f"load crop geometry from {output_dir}")
+        return output_dir
+
+    print(f"build crop geometry -> {output_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+    game_plays = []
+    for game_play, view, df in build_crop_geometry(base_dir=base_dir,
+                                                   traintest=traintest,
+                                                   master_data_path=master_data_path,
+                                                   distance_threshold=distance_threshold,
+                                                   interpolate_limit=interpolate_limit):
+        df.to_feather(f"{output_dir}/{game_play}_{view}.feather")
+        if game_play not in game_plays:
+            game_plays.append(game_play)
+
+    # written last: marks the cache as complete
+    with open(f"{output_dir}/params.json", "w") as f:
+        json.dump(params, f, indent=2)
+    with open(f"{output_dir}/game_plays.json", "w") as f:
+        json.dump(game_plays, f)
+    return output_dir
+
+
+def load_game_plays(geometry_dir: str):
+    with open(f"{geometry_dir}/game_plays.json", "r") as f:
+        return json.load(f)
+
+
+def load_crop_geometry(geometry_dir: str, game_play: str, view: str):
+    return pd.read_feather(f"{geometry_dir}/{game_play}_{view}.feather")
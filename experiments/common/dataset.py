@@ -0,0 +1,153 @@
+import pandas as pd
+import numpy as np
+import os
+import shutil
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+from sklearn.model_selection import GroupKFold
+from typing import List
+from .master_data import read_manifest, load_master_data
+
+PARTITION_COLUMNS = ["game_key", "game_play"]
+# rows of a pair in step order (item windows, lag features)
+SORT_COLUMNS = ["game_play", "nfl_player_id_1", "nfl_player_id_2", "step"]
+# original schema of a partitioned dataset, "_" prefix: not a data file for pyarrow.dataset
+SCHEMA_NAME = "_schema.feather"
+
+
+def split_fold(df_label: pd.DataFrame,
+               fold: int,
+               key: str = "game_key",
+               n_splits: int = 5):
+    """
+    (df_label_train, df_label_val) of `fold`. same split as the GroupKFold loops in the experiment scripts.
+    """
+    gkfold = GroupKFold(n_splits)
+    for i, (train_idx, val_idx) in enumerate(gkfold.split(df_label, groups=df_label[key].values)):
+        if i == fold:
+            return df_label.iloc[train_idx], df_label.iloc[val_idx]
+    raise ValueError(f"fold={fold} (n_splits={n_splits})")
+
+
+def is_partitioned(path: str):
+    return os.path.isdir(path) and any(x.startswith(f"{PARTITION_COLUMNS[0]}=") for x in os.listdir(path))
+
+
+def _write_dataset(table: pa.Table,
+                   path: str,
+                   partition_columns: List[str],
+                   existing_data_behavior: str):
+    schema = table.schema
+    for col in partition_columns:
+        # float keys (NaN free) would be written as "58168.0"
+        if pa.types.is_floating(schema.field(col).type) and table[col].null_count == 0:
+            table = table.set_column(table.schema.get_field_index(col), col, table[col].cast(pa.int64()))
+    ds.write_dataset(
+        table,
+        path,
+        format="feather",
+        partitioning=partition_columns,
+        partitioning_flavor="hive",
+        existing_data_behavior=existing_data_behavior,
+        preserve_order=True,
+    )
+    # the partition columns are dropped from the files: keep the original schema (dtypes, column order).
+    # written last, a directory without it is an interrupted / older write
+    feather.write_feather(schema.empty_table(), f"{path}/{SCHEMA_NAME}")
+
+
+def has_schema(path: str):
+    return os.path.isfile(f"{path}/{SCHEMA_NAME}")
+
+
+def write_partitioned(df: pd.DataFrame,
+                      path: str,
+                      partition_columns: List[str] = PARTITION_COLUMNS):
+    """
+    write `df` as a hive partitioned feather dataset: {path}/game_key=xxx/game_play=xxx/part-0.feather
+    """
+    _write_dataset(pa.Table.from_pandas(df, preserve_index=False), path, partition_columns, "delete_matching")
+
+
+def partition_feather(src: str,
+                      path: str,
+                      partition_columns: List[str] = PARTITION_COLUMNS):
+    """
+    rewrite a single feather file (old outputs) as a write_partitioned dataset at `path` (replaced if it exists).
+    the file is memory mapped and goes to the dataset as an arrow table, it is never converted to pandas.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    _write_dataset(feather.read_table(src, memory_map=True), path, partition_columns, "error")
+
+
+def read_partitioned(path: str,
+                     filters: dict = None,
+                     columns: List[str] = None):
+    """
+    read a dataset written by write_partitioned. `filters`: {column: values} (isin),
+    only the partitions matching the filter and only `columns` are read from disk.
+    partition columns get back their dtype and position, rows are sorted by pair and step.
+    """
+    dataset = ds.dataset(path, format="feather", partitioning="hive")
+    expr = None
+    if filters is not None:
+        for col, values in filters.items():
+            e = ds.field(col).isin(list(values))
+            expr = e if expr is None else expr & e
+    df = dataset.to_table(columns=columns, filter=expr).to_pandas()
+    if has_schema(path):
+        df_schema = feather.read_feather(f"{path}/{SCHEMA_NAME}")
+        for col in df.columns:
+            if col not in df_schema.columns or df[col].dtype == df_schema[col].dtype:
+                continue
+            if isinstance(df_schema[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(object).astype("category")
+            else:
+                df[col] = df[col].astype(df_schema[col].dtype)
+        df = df[[col for col in df_schema.columns if col in df.columns]]
+    sort_columns = [col for col in SORT_COLUMNS if col in df.columns]
+    if len(sort_columns) > 0:
+        df = df.sort_values(sort_columns, kind="stable")
+    return df.reset_index(drop=True)
+
+
+def read_fold(path: str,
+              key: str,
+              values,
+              columns: List[str] = None):
+    """
+    rows whose `key` (game_key or game_play) is in `values`.
+    partitioned dataset / master_data_v5 shards: read only the partitions holding them.
+    single feather file: read everything and filter (old outputs).
+    """
+    return read_folds(path, key, [values], columns=columns)[0]
+
+
+def read_folds(path: str,
+               key: str,
+               values_list: List,
+               columns: List[str] = None):
+    """
+    read_fold for several key sets (e.g. train / val keys), a single feather file is read only once.
+    """
+    values_list = [pd.unique(np.asarray(values)) for values in values_list]
+    if is_partitioned(path):
+        return [read_partitioned(path, filters={key: values}, columns=columns) for values in values_list]
+
+    if os.path.isdir(path) and len(read_manifest(path)) > 0:
+        all_game_plays = list(read_manifest(path).keys())
+        ret = []
+        for values in values_list:
+            if key == "game_key":
+                values = set(int(x) for x in values)
+                game_plays = [game_play for game_play in all_game_plays if int(game_play.split("_")[0]) in values]
+            else:
+                values = set(values)
+                game_plays = [game_play for game_play in all_game_plays if game_play in values]
+            ret.append(load_master_data(path, game_plays=game_plays, columns=columns))
+        return ret
+
+    df = load_master_data(path, columns=columns)
+    return [df[df[key].isin(values)].reset_index(drop=True) for values in values_list]
@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+import os
+import glob
+import hashlib
+import pyarrow.feather as feather
+
+# existence of the crops of an image tree, replacing a set of path strings:
+#   {path}.groups.feather  game_play, view, id_1, id_2, frame_min, n_frames, offset (one row per video x pair, written last)
+#   {path}.group_keys      int64 key of every group (encode_group_keys), ascending: groups are stored in key order
+#   {path}.bits            packed bits, crop (group, frame) exists <-> bit offset + frame - frame_min is set
+# a query is a searchsorted on the keys + a bit lookup (both memory mapped, shared by all processes).
+FRAME_INDEX_NAME = "frame_index"
+GROUPS_SUFFIX = ".groups.feather"
+GROUP_KEYS_SUFFIX = ".group_keys"
+BITS_SUFFIX = ".bits"
+# group key: ((game_play code * n_views + view code) << 2 * ID_BITS) | (id_1 << ID_BITS) | id_2, ids: "G" -> 0, id -> id + 1
+ID_BITS = 21
+# per video keys written by the renderers: {output_dir}/{game_play}/{view}.keys.feather (id_1, id_2, frame)
+KEYS_SUFFIX = ".keys.feather"
+GROUP_COLS = ["game_play", "view", "id_1", "id_2"]
+
+
+def write_video_keys(path: str, keys):
+    """
+    keys: [(id_1, id_2, frame), ...] of the crops written for one video.
+    """
+    df = pd.DataFrame(list(keys), columns=["id_1", "id_2", "frame"])
+    df["id_1"] = df["id_1"].astype(str)
+    df["id_2"] = df["id_2"].astype(str)
+    df["frame"] = df["frame"].astype(np.int32)
+    df = df.sort_values(["id_1", "id_2", "frame"]).reset_index(drop=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    feather.write_feather(df, f"{path}{KEYS_SUFFIX}.tmp")
+    os.replace(f"{path}{KEYS_SUFFIX}.tmp", f"{path}{KEYS_SUFFIX}")
+
+
+def read_video_keys(base_dir: str):
+    """
+    game_play, view, id_1, id_2, frame of every crop recorded by write_video_keys under base_dir.
+    """
+    dfs = []
+    for path in sorted(glob.glob(f"{base_dir}/*/*{KEYS_SUFFIX}")):
+        path = path.replace("\\", "/")
+        df = feather.read_feather(path)
+        df["game_play"] = path.split("/")[-2]
+        df["view"] = os.path.basename(path)[:-len(KEYS_SUFFIX)]
+        dfs.append(df)
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=GROUP_COLS + ["frame"])
+    return pd.concat(dfs, ignore_index=True)
+
+
+def frame_keys_from_files(base_dir: str, extention: str = ".jpg"):
+    """
+    keys of a loose-file tree ({base_dir}/{game_play}/{view}/{id_1}_{id_2}_{frame}[_original]{extention}), by glob.
+    for trees rendered before the renderers recorded their keys.
+    """
+    files = pd.Series([f.replace("\\", "/") for f in glob.glob(f"{base_dir}/*/*/*{extention}")], dtype=object)
+    if len(files) == 0:
+        return pd.DataFrame(columns=GROUP_COLS + ["frame"])
+    parts = files.str[len(base_dir) + 1:-len(extention)].str.split("/", expand=True)
+    names = parts[2].str.split("_", expand=True)
+    df = pd.DataFrame({
+        "game_play": parts[0],
+        "view": parts[1],
+        "id_1": names[0],
+        "id_2": names[1],
+        "frame": names[2],
+    })
+    if names.shape[1] > 3:
+        # channel_6: {frame}_original + {frame}_filter -> one key per frame, only when both files exist
+        df_original = df[names[3] == "original"]
+        df_filter = df[names[3] == "filter"]
+        df = pd.concat([
+            df[names[3].isnull()],
+            df_original.merge(df_filter[GROUP_COLS + ["frame"]], on=GROUP_COLS + ["frame"]),
+        ])
+    df["frame"] = df["frame"].astype(np.int32)
+    return df.reset_index(drop=True)
+
+
+def _encode_player_ids(ids):
+    ids = np.asarray(ids).astype(str)
+    is_g = ids == "G"
+    return np.where(is_g, "-1", ids).astype(np.int64) + 1
+
+
+def _codes(uniques: np.ndarray, values):
+    """
+    position of every value in the sorted `uniques`, -1 if not in it.
+    """
+    values = np.asarray(values).astype(str)
+    if len(uniques) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    codes = np.clip(np.searchsorted(uniques, values), 0, len(uniques) - 1)
+    return np.where(uniques[codes] == values, codes, -1).astype(np.int64)
+
+
+def _code(uniques: np.ndarray, value):
+    i = int(np.searchsorted(uniques, value))
+    return i if i < len(uniques) and uniques[i] == value else -1
+
+
+def encode_group_keys(game_play_codes, view_codes, n_views: int, id_1s, id_2s):
+    return (
+        ((np.asarray(game_play_codes, dtype=np.int64) * n_views + np.asarray(view_codes, dtype=np.int64)) << (2 * ID_BITS)) |
+        (_encode_player_ids(id_1s) << ID_BITS) | _encode_player_ids(id_2s)
+    )
+
+
+class FrameIndex:
+    """
+    existence of crops keyed by (game_play, view, id_1, id_2, frame).
+    contains / exists: one pair, exists_at: any number of (group, frame) at once (see group_ids).
+    """
+    def __init__(self, groups: pd.DataFrame, bits: np.ndarray, group_keys: np.ndarray = None):
+        self.groups = groups
+        self.bits = bits
+        self.frame_min = groups["frame_min"].values.astype(np.int64)
+        self.n_frames = groups["n_frames"].values.astype(np.int64)
+        self.offset = groups["offset"].values.astype(np.int64)
+        # game_play / view codes: position in the sorted unique values of the index
+        self.game_plays = np.unique(groups["game_play"].to_numpy().astype(str))
+        self.views = np.unique(groups["view"].to_numpy().astype(str))
+        if group_keys is None:
+            group_keys = self._group_keys(groups["game_play"], groups["view"], groups["id_1"], groups["id_2"])
+        self.group_keys = group_keys
+
+    def _group_keys(self, game_plays, views, id_1s, id_2s):
+        """
+        (keys, valid): valid is False where game_play / view is not in the index.
+        """
+        game_play_codes = _codes(self.game_plays, game_plays)
+        view_codes = _codes(self.views, views)
+        keys = encode_group_keys(np.maximum(game_play_codes, 0), np.maximum(view_codes, 0), len(self.views), id_1s, id_2s)
+        return np.where((game_play_codes >= 0) & (view_codes >= 0), keys, -1)
+
+    @classmethod
+    def from_keys(cls, keys: pd.DataFrame):
+        """
+        keys: game_play, view, id_1, id_2, frame (duplicates allowed).
+        """
+        keys = keys[GROUP_COLS + ["frame"]].copy()
+        for col in GROUP_COLS:
+            keys[col] = keys[col].astype(str)
+        keys["frame"] = keys["frame"].astype(np.int64)
+        game_plays = np.unique(keys["game_play"].to_numpy())
+        views = np.unique(keys["view"].to_numpy())
+        keys["group_key"] = encode_group_keys(
+            _codes(game_plays, keys["game_play"]), _codes(views, keys["view"]), len(views), keys["id_1"], keys["id_2"]
+        )
+        group = keys.groupby("group_key", sort=True)
+        groups = group[GROUP_COLS].first()
+        groups["frame_min"] = group["frame"].min().astype(np.int64)
+        groups["n_frames"] = (group["frame"].max() - groups["frame_min"] + 1).astype(np.int64)
+        groups["offset"] = (np.cumsum(groups["n_frames"].values) - groups["n_frames"].values).astype(np.int64)
+        group_keys = groups.index.values.astype(np.int64)
+        groups = groups.reset_index(drop=True)
+
+        group_idx = group.ngroup().values
+        pos = groups["offset"].values[group_idx] + keys["frame"].values - groups["frame_min"].values[group_idx]
+        bits = np.zeros(groups["n_frames"].sum(), dtype=bool)
+        bits[pos] = True
+        return cls(groups, np.packbits(bits), group_keys)
+
+    @classmethod
+    def load(cls, path: str):
+        groups = feather.read_feather(f"{path}{GROUPS_SUFFIX}")
+        if len(groups) == 0:
+            return cls(groups, np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64))
+        return cls(
+            groups,
+            np.memmap(f"{path}{BITS_SUFFIX}", dtype=np.uint8, mode="r"),
+            np.memmap(f"{path}{GROUP_KEYS_SUFFIX}", dtype=np.int64, mode="r"),
+        )
+
+    @staticmethod
+    def exists_on_disk(path: str):
+        # indexes saved before the group keys were stored are rebuilt
+        return os.path.isfile(f"{path}{GROUPS_SUFFIX}") and os.path.isfile(f"{path}{GROUP_KEYS_SUFFIX}")
+
+    def save(self, path: str):
+        with open(f"{path}{BITS_SUFFIX}.tmp", "wb") as f:
+            f.write(np.asarray(self.bits, dtype=np.uint8).tobytes())
+        os.replace(f"{path}{BITS_SUFFIX}.tmp", f"{path}{BITS_SUFFIX}")
+        with open(f"{path}{GROUP_KEYS_SUFFIX}.tmp", "wb") as f:
+            f.write(np.asarray(self.group_keys, dtype=np.int64).tobytes())
+        os.replace(f"{path}{GROUP_KEYS_SUFFIX}.tmp", f"{path}{GROUP_KEYS_SUFFIX}")
+        feather.write_feather(self.groups, f"{path}{GROUPS_SUFFIX}.tmp")
+        os.replace(f"{path}{GROUPS_SUFFIX}.tmp", f"{path}{GROUPS_SUFFIX}")
+
+    def fingerprint(self):
+        """
+        content hash (groups + bits): changes whenever any crop is added or removed.
+        """
+        h = hashlib.md5(pd.util.hash_pandas_object(self.groups, index=False).values.tobytes())
+        h.update(np.asarray(self.bits).tobytes())
+        return h.hexdigest()
+
+    def __len__(self):
+        return int(np.unpackbits(np.asarray(self.bits)).sum())
+
+    def group_ids(self, game_plays, views, id_1s, id_2s):
+        """
+        group of every (game_play, view, id_1, id_2), -1 if the pair has no crop in the video.
+        """
+        keys = self._group_keys(game_plays, views, id_1s, id_2s)
+        if len(self.group_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        idx = np.clip(np.searchsorted(self.group_keys, keys), 0, len(self.group_keys) - 1)
+        return np.where((keys >= 0) & (np.asarray(self.group_keys[idx]) == keys), idx, -1).astype(np.int64)
+
+    def group_id(self, game_play: str, view: str, id_1, id_2):
+        """
+        group_ids of a single pair without the array conversions.
+        """
+        game_play_code = _code(self.game_plays, str(game_play))
+        view_code = _code(self.views, str(view))
+        if game_play_code < 0 or view_code < 0:
+            return -1
+        id_1 = 0 if str(id_1) == "G" else int(id_1) + 1
+        id_2 = 0 if str(id_2) == "G" else int(id_2) + 1
+        key = ((game_play_code * len(self.views) + view_code) << (2 * ID_BITS)) | (id_1 << ID_BITS) | id_2
+        return _code(self.group_keys, key)
+
+    def exists_at(self, groups, frames):
+        """
+        bool array (broadcast shape of groups, frames): the crop of group (group_ids) at frame exists.
+        """
+        groups, frames = np.broadcast_arrays(np.asarray(groups, dtype=np.int64), np.asarray(frames, dtype=np.int64))
+        ret = np.zeros(groups.shape, dtype=bool)
+        valid = groups >= 0
+        groups = np.where(valid, groups, 0)
+        if len(self.offset) == 0:
+            return ret
+        rel = frames - self.frame_min[groups]
+        valid &= (rel >= 0) & (rel < self.n_frames[groups])
+        pos = self.offset[groups[valid]] + rel[valid]
+        ret[valid] = (np.asarray(self.bits[pos >> 3]) >> (7 - (pos & 7))) & 1
+        return ret
+
+    def exists(self, game_play: str, view: str, id_1, id_2, frames):
+        return self.exists_at(self.group_id(game_play, view, id_1, id_2), frames)
+
+    def contains(self, game_play: str, view: str, id_1, id_2, frame: int):
+        return bool(self.exists(game_play, view, id_1, id_2, [frame])[0])
+
+    def first_key(self):
+        """
+        (game_play, view, id_1, id_2, frame) of the first existing crop, None if there is none.
+        reads only the bits of the first group (every group has at least one crop).
+        """
+        if len(self.groups) == 0:
+            return None
+        n_frames = self.n_frames[0]
+        bits = np.unpackbits(np.asarray(self.bits[:(n_frames + 7) // 8]))[:n_frames]
+        return (*self.groups[GROUP_COLS].iloc[0].values, int(self.frame_min[0] + np.argmax(bits)))
+
+    def keys(self):
+        """
+        game_play, view, id_1, id_2, frame of every existing crop.
+        """
+        pos = np.where(np.unpackbits(np.asarray(self.bits))[:self.n_frames.sum()])[0]
+        group_idx = np.searchsorted(self.offset, pos, side="right") - 1
+        df = self.groups.iloc[group_idx][GROUP_COLS].reset_index(drop=True)
+        df["frame"] = (pos - self.offset[group_idx] + self.frame_min[group_idx]).astype(np.int32)
+        return df
+
+
+def build_frame_index(base_dir: str):
+    """
+    merge the per video keys of base_dir (write_video_keys) into {base_dir}/frame_index.
+    """
+    frame_index = FrameIndex.from_keys(read_video_keys(base_dir))
+    frame_index.save(f"{base_dir}/{FRAME_INDEX_NAME}")
+    return frame_index
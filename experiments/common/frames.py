@@ -0,0 +1,208 @@
+import cv2
+import collections
+import numpy as np
+import pandas as pd
+import os
+import glob
+import threading
+import pyarrow as pa
+import pyarrow.feather as feather
+from .codecs import get_codec
+from .pipeline import read_video, run_render_pipeline
+
+
+class LRUCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self.data:
+            return None
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.capacity:
+            self.data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class VideoFrameSource:
+    """
+    frames straight from {video_dir}/{game_play}_{view}.mp4.
+    get_frames decodes the requested frames in one pass (grab() / seek for the gaps, see pipeline.plan_frames).
+    """
+    def __init__(self, video_dir: str, seek_gap: int = 30):
+        self.video_dir = video_dir
+        self.seek_gap = seek_gap
+
+    def get_frames(self, game_play: str, view: str, frame_indices):
+        """
+        {frame: img (H, W, 3) uint8} of the requested frames (frames outside the video are missing).
+        """
+        video_path = f"{self.video_dir}/{game_play}_{view}.mp4"
+        return dict(read_video(video_path, frames=np.asarray(frame_indices), seek_gap=self.seek_gap))
+
+
+# full frames of one video:
+#   {path}.bin            encoded frames in (roughly) frame order
+#   {path}.index.feather  frame, offset, length (written last), codec / chunk_size / scale in the schema metadata
+# frames are read in chunks of `chunk_size` consecutive frame indices: every chunk touched by a request is read with
+# one seek + read (consecutive chunks are merged), so a window of frames costs a single read.
+FRAMES_BIN_SUFFIX = ".bin"
+FRAMES_INDEX_SUFFIX = ".index.feather"
+
+
+class FrameWriter:
+    """
+    stores the frames of one video (thread safe). frames are resized by `scale` and encoded with `codec`
+    (common.codecs) in add(), and appended to the .bin file in arrival order.
+    """
+    def __init__(self, path: str, codec: str = "jpg", chunk_size: int = 32, scale: float = 1.0):
+        self.path = path
+        self.codec_name = codec
+        self.codec = get_codec(codec)
+        self.chunk_size = chunk_size
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.records = []
+        self.offset = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.f = open(f"{self.path}{FRAMES_BIN_SUFFIX}.tmp", "wb")
+
+    def add(self, frame: int, img: np.ndarray):
+        if self.scale != 1.0:
+            img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        buf = self.codec.encode(img)
+        with self.lock:
+            self.f.write(buf)
+            self.records.append((int(frame), self.offset, len(buf)))
+            self.offset += len(buf)
+
+    def close(self):
+        self.f.close()
+        os.replace(f"{self.path}{FRAMES_BIN_SUFFIX}.tmp", f"{self.path}{FRAMES_BIN_SUFFIX}")
+        df = pd.DataFrame(self.records, columns=["frame", "offset", "length"])
+        df = df.sort_values("frame").reset_index(drop=True)
+        df["frame"] = df["frame"].astype(np.int32)
+        df["offset"] = df["offset"].astype(np.int64)
+        df["length"] = df["length"].astype(np.int32)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"codec": self.codec_name.encode(),
+            b"chunk_size": str(self.chunk_size).encode(),
+            b"scale": str(self.scale).encode(),
+        })
+        feather.write_feather(table, f"{self.path}{FRAMES_INDEX_SUFFIX}.tmp")
+        os.replace(f"{self.path}{FRAMES_INDEX_SUFFIX}.tmp", f"{self.path}{FRAMES_INDEX_SUFFIX}")
+        self.records = []
+        return len(df)
+
+
+def write_frames(video_path: str,
+                 path: str,
+                 frames=None,
+                 codec: str = "jpg",
+                 chunk_size: int = 32,
+                 scale: float = 1.0,
+                 n_writers: int = 2,
+                 queue_size: int = 16):
+    """
+    decode `frames` (all if None) of `video_path` once and store them at `path` (FrameWriter).
+    resize / encode run on `n_writers` threads. returns the read_video stats + n_images.
+    """
+    writer = FrameWriter(path, codec=codec, chunk_size=chunk_size, scale=scale)
+    stats = {}
+    n_images = run_render_pipeline(
+        read_video(video_path, frames=frames, stats=stats),
+        lambda frame, img: [(frame, img)],
+        n_render_workers=1,
+        n_writers=n_writers,
+        queue_size=queue_size,
+        writer=lambda item: writer.add(*item),
+    )
+    writer.close()
+    return {"n_images": n_images, **stats}
+
+
+class FrameStore:
+    """
+    random access to the frames written by FrameWriter under {base_dir}/{game_play}/{view}.
+    same interface as VideoFrameSource: get_frames decodes only the requested frames, reading each run of
+    chunks they fall in with one seek + read. frames are returned at the stored scale
+    (CropRenderer needs scale 1: the crop geometry is in video pixels).
+    """
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self.indices = {}
+
+    def videos(self):
+        ret = []
+        for path in sorted(glob.glob(f"{self.base_dir}/*/*{FRAMES_INDEX_SUFFIX}")):
+            path = path.replace("\\", "/")
+            ret.append((path.split("/")[-2], os.path.basename(path)[:-len(FRAMES_INDEX_SUFFIX)]))
+        return ret
+
+    def index(self, game_play: str, view: str):
+        """
+        (frames, offsets, lengths, meta) of one video, None if the video is not stored.
+        meta: {"codec", "chunk_size", "scale"}.
+        """
+        key = (game_play, view)
+        if key not in self.indices:
+            path = f"{self.base_dir}/{game_play}/{view}{FRAMES_INDEX_SUFFIX}"
+            index = None
+            if os.path.isfile(path):
+                table = feather.read_table(path)
+                metadata = table.schema.metadata or {}
+                meta = {
+                    "codec": get_codec(metadata.get(b"codec", b"jpg").decode()),
+                    "chunk_size": int(metadata.get(b"chunk_size", b"32")),
+                    "scale": float(metadata.get(b"scale", b"1.0")),
+                }
+                df = table.to_pandas()
+                index = (df["frame"].values, df["offset"].values, df["length"].values, meta)
+            self.indices[key] = index
+        return self.indices[key]
+
+    def get_frames(self, game_play: str, view: str, frame_indices, flags=cv2.IMREAD_COLOR):
+        """
+        {frame: img} of the requested frames (frames not stored are missing).
+        """
+        index = self.index(game_play, view)
+        if index is None:
+            return {}
+        stored_frames, offsets, lengths, meta = index
+        frames = np.unique(np.asarray(frame_indices, dtype=np.int64))
+        pos = np.clip(np.searchsorted(stored_frames, frames), 0, len(stored_frames) - 1)
+        pos = pos[stored_frames[pos] == frames]
+        if len(pos) == 0:
+            return {}
+
+        # every stored frame of the touched chunks, grouped into runs of consecutive chunks
+        chunk_size = meta["chunk_size"]
+        stored_chunks = stored_frames // chunk_size
+        chunks = np.unique(stored_chunks[pos])
+        runs = np.split(chunks, np.where(np.diff(chunks) > 1)[0] + 1)
+
+        ret = {}
+        with open(f"{self.base_dir}/{game_play}/{view}{FRAMES_BIN_SUFFIX}", "rb") as f:
+            for run in runs:
+                in_run = (stored_chunks >= run[0]) & (stored_chunks <= run[-1])
+                start = offsets[in_run].min()
+                end = (offsets[in_run] + lengths[in_run]).max()
+                f.seek(start)
+                buf = f.read(end - start)
+                for i in pos[(stored_chunks[pos] >= run[0]) & (stored_chunks[pos] <= run[-1])]:
+                    offset = offsets[i] - start
+                    ret[int(stored_frames[i])] = meta["codec"].decode(buf[offset:offset + lengths[i]], flags)
+        return ret
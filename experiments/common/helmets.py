@@ -0,0 +1,203 @@
+import pandas as pd
+import numpy as np
+from typing import List
+
+
+def _track_ids(df: pd.DataFrame, keys: List[str]):
+    """
+    sort rows by (keys, frame) and return the sorted dataframe with an integer track id per row.
+    """
+    df = df.sort_values(keys + ["frame"], kind="stable").reset_index(drop=True)
+    track_id = df.groupby(keys, sort=False, observed=True).ngroup().values
+    return df, track_id
+
+
+def interpolate_tracks(values: np.ndarray,
+                       track_id: np.ndarray,
+                       limit: int = 10):
+    """
+    Bulk version of `Series.interpolate(limit=limit, limit_area="inside")` applied per track.
+    values: (n_rows,) float array, rows of the same track must be contiguous.
+    """
+    valid = ~np.isnan(values)
+    if valid.all() or not valid.any():
+        return values
+    values = values.astype(np.float64, copy=True)
+    n = len(values)
+    idx = np.arange(n)
+
+    prev_idx = np.maximum.accumulate(np.where(valid, idx, -1))
+    next_idx = np.minimum.accumulate(np.where(valid, idx, n)[::-1])[::-1]
+
+    fill = ~valid & (prev_idx >= 0) & (next_idx < n)
+    fill_idx = idx[fill]
+    prev_ = prev_idx[fill]
+    next_ = next_idx[fill]
+
+    # inside the same track only, and at most `limit` consecutive NaNs (forward direction)
+    ok = (track_id[prev_] == track_id[fill_idx]) & (track_id[next_] == track_id[fill_idx])
+    if limit is not None:
+        ok &= (fill_idx - prev_) <= limit
+    fill_idx, prev_, next_ = fill_idx[ok], prev_[ok], next_[ok]
+
+    ratio = (fill_idx - prev_) / (next_ - prev_)
+    values[fill_idx] = values[prev_] + (values[next_] - values[prev_]) * ratio
+    return values
+
+
+def densify_helmets(df_helmets: pd.DataFrame,
+                    keys: List[str] = ("game_play", "view", "nfl_player_id"),
+                    interpolate_cols: List[str] = (),
+                    limit: int = 10):
+    """
+    Fill missing frames of every helmet track (rows grouped by `keys`) between its first and last frame.
+    Same result as merging each group against np.arange(frame_min, frame_max+1) and interpolating
+    `interpolate_cols` with `interpolate(limit=limit, limit_area="inside")`, but done for all tracks at once.
+    """
+    keys = list(keys)
+    df, track_id = _track_ids(df_helmets, keys)
+    frames = df["frame"].values.astype(np.int64)
+
+    n_tracks = track_id.max() + 1 if len(df) > 0 else 0
+    frame_min = np.full(n_tracks, np.iinfo(np.int64).max)
+    frame_max = np.full(n_tracks, np.iinfo(np.int64).min)
+    np.minimum.at(frame_min, track_id, frames)
+    np.maximum.at(frame_max, track_id, frames)
+
+    lengths = frame_max - frame_min + 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    n_dense = lengths.sum()
+
+    # position of every existing row on the dense (track, frame) grid
+    pos = offsets[track_id] + frames - frame_min[track_id]
+    missing = np.bincount(pos, minlength=n_dense) == 0
+    missing_pos = np.flatnonzero(missing)
+    missing_track = np.repeat(np.arange(n_tracks), lengths)[missing_pos]
+
+    first_row = np.concatenate([[0], np.flatnonzero(np.diff(track_id)) + 1]) if len(df) > 0 else np.array([], dtype=int)
+    df_missing = df[keys].iloc[first_row[missing_track]].reset_index(drop=True)
+    df_missing["frame"] = frame_min[missing_track] + missing_pos - offsets[missing_track]
+
+    df = pd.concat([df, df_missing], ignore_index=True)
+    order = np.argsort(np.concatenate([pos, missing_pos]), kind="stable")
+    df = df.iloc[order].reset_index(drop=True)
+    track_id = np.concatenate([track_id, missing_track])[order]
+
+    for col in interpolate_cols:
+        df[col] = interpolate_tracks(df[col].values, track_id, limit=limit)
+
+    columns = ["frame"] + [col for col in df_helmets.columns if col != "frame"]
+    return df[columns]
+
+
+def _take(values: np.ndarray, idx: np.ndarray, mask: np.ndarray):
+    """
+    values[idx] where mask else NaN (numeric columns become float).
+    """
+    if values.dtype.kind in "iufb":
+        ret = values.astype(np.float64)[np.where(mask, idx, 0)]
+        ret[~mask] = np.nan
+    else:
+        ret = values.astype(object)[np.where(mask, idx, 0)]
+        ret[~mask] = np.nan
+    return ret
+
+
+def _to_ns(values):
+    """
+    datetime-like (tz-aware or naive) -> int64 nanoseconds
+    """
+    return pd.DatetimeIndex(values).values.astype("datetime64[ns]").view(np.int64)
+
+
+def _first_index(keys: np.ndarray, order: np.ndarray, query: np.ndarray):
+    """
+    row index (first in `order`) of every `query` key in `keys`, and whether it was found.
+    """
+    sorted_keys = keys[order]
+    pos = np.searchsorted(sorted_keys, query, side="left")
+    pos_ = np.minimum(pos, len(sorted_keys) - 1)
+    found = (pos < len(sorted_keys)) & (sorted_keys[pos_] == query) if len(sorted_keys) > 0 else np.zeros(len(query), dtype=bool)
+    return order[pos_] if len(order) > 0 else np.zeros(len(query), dtype=int), found
+
+
+def join_helmets_contact(game_play, labels, helmets, meta, view="Sideline", fps=59.94):
+    """
+    Joins helmets and labels for a given game_play and view: one row per label with the closest video frame.
+    Same result as the merge -> rank(method="first") -> groupby("datetime_ngs") fill version in master_data_v4,
+    but the (player, datetime_ngs) -> frame mapping is a sorted search instead of a many-to-many merge.
+    """
+    helmet_columns = ["left", "width", "top", "height", "x", "y", "team"]
+
+    gp_labs = labels.query("game_play == @game_play")
+    gp_helms = helmets.query("game_play == @game_play and view == @view")
+
+    start_time = meta.query("game_play == @game_play and view == @view")[
+        "start_time"
+    ].values[0]
+
+    helm_datetime = pd.to_timedelta(gp_helms["frame"] * (1 / fps), unit="s") + start_time
+    helm_datetime = pd.to_datetime(helm_datetime, utc=True)
+    helm_ngs = pd.DatetimeIndex(helm_datetime + pd.to_timedelta(50, "ms")).floor("100ms").values
+    helm_ngs = pd.to_datetime(helm_ngs, utc=True)
+    labs_ngs = pd.to_datetime(gp_labs["datetime"], utc=True)
+
+    helm_frames = gp_helms["frame"].values.astype(np.int64)
+    helm_ngs_ns = _to_ns(helm_ngs)
+    labs_ngs_ns = _to_ns(labs_ngs)
+    helm_diff = np.abs(_to_ns(helm_datetime) - helm_ngs_ns)
+
+    # integer codes for players and NGS timestamps
+    players = pd.Index(gp_helms["nfl_player_id"].unique())
+    helm_player = players.get_indexer(gp_helms["nfl_player_id"].values)
+    labs_player_1 = players.get_indexer(gp_labs["nfl_player_id_1"].values)
+    labs_player_2 = players.get_indexer(gp_labs["nfl_player_id_2"].values)
+
+    ngs_codes, ngs_uniques = pd.factorize(np.concatenate([helm_ngs_ns, labs_ngs_ns]))
+    n_ngs = len(ngs_uniques)
+    helm_ngs_code = ngs_codes[:len(gp_helms)]
+    labs_ngs_code = ngs_codes[len(gp_helms):]
+
+    # player_1: closest frame to datetime_ngs (ties -> first helmet row)
+    helm_key_1 = helm_player * n_ngs + helm_ngs_code
+    row_idx = np.arange(len(gp_helms))
+    order = np.lexsort((row_idx, helm_diff, helm_key_1))
+    idx_1, found_1 = _first_index(helm_key_1, order, labs_player_1 * n_ngs + labs_ngs_code)
+    found_1 &= labs_player_1 >= 0
+
+    # player_2: same frame as player_1
+    frame_min = helm_frames.min() if len(helm_frames) > 0 else 0
+    frame_span = (helm_frames.max() - frame_min + 1) if len(helm_frames) > 0 else 1
+    helm_key_2 = helm_player * frame_span + (helm_frames - frame_min)
+    labs_frame = np.where(found_1, helm_frames[np.where(found_1, idx_1, 0)] if len(helm_frames) > 0 else 0, frame_min)
+    idx_2, found_2 = _first_index(
+        helm_key_2, np.argsort(helm_key_2, kind="stable"), labs_player_2 * frame_span + (labs_frame - frame_min)
+    )
+    found_2 &= found_1 & (labs_player_2 >= 0)
+
+    # labels without helmet: mean frame of the same NGS step
+    frame_sum = np.bincount(labs_ngs_code, weights=np.where(found_1, labs_frame, 0), minlength=n_ngs)
+    frame_count = np.bincount(labs_ngs_code, weights=found_1, minlength=n_ngs)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frame_mean = np.round(frame_sum / frame_count)
+    frame = np.where(found_1, labs_frame, frame_mean[labs_ngs_code])
+    frame = np.nan_to_num(frame, nan=0).astype(int)
+
+    gp = pd.DataFrame({
+        "contact_id": gp_labs["contact_id"].values,
+        "game_play": gp_labs["game_play"].values,
+        "step": gp_labs["step"].values,
+        "nfl_player_id_1": gp_labs["nfl_player_id_1"].values,
+        "nfl_player_id_2": gp_labs["nfl_player_id_2"].values,
+        "contact": gp_labs["contact"].values,
+        "frame": frame,
+        "datetime": labs_ngs.array,
+        "view": view,
+    })
+    for player_id, idx, found in [(1, idx_1, found_1), (2, idx_2, found_2)]:
+        for col in helmet_columns:
+            gp[f"{col}_{player_id}"] = _take(gp_helms[col].values, idx, found)
+
+    gp = gp.iloc[np.argsort(labs_ngs_ns, kind="stable")].reset_index(drop=True)
+    gp["game_play"] = gp["game_play"].fillna(game_play)
+    return gp
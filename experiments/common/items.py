@@ -0,0 +1,391 @@
+import numpy as np
+import pandas as pd
+import os
+import json
+import pickle
+import hashlib
+from typing import Callable, List
+from .master_data import fingerprint
+
+PAIR_COLS = ["game_play", "nfl_player_id_1", "nfl_player_id_2"]
+# bump when build_items changes -> cached items are rebuilt
+ITEMS_VERSION = "v3"
+
+
+def build_items(df: pd.DataFrame,
+                count_exist: Callable,
+                n_frames: int,
+                step: int,
+                n_predict_frames: int,
+                distance_threshold: float,
+                exist_image_threshold: float,
+                exist_center_image_threshold: float,
+                use_data_step: int = 1,
+                frame_adjust: int = 0,
+                negative_sample_ratio_close: float = 1,
+                negative_sample_ratio_far: float = 1,
+                negative_sample_ratio_g: float = 1,
+                soft_label_range: tuple = None,
+                feature_window: int = 0,
+                feature_cols: List[str] = None,
+                only_g: bool = False,
+                test: bool = False,
+                seed: int = 0):
+    """
+    the windows (items) of NFLDataset, computed for all rows at once.
+    one item per row of a (game_play, id_1, id_2) pair:
+      frames: n_frames frames around the row, every `step` frames
+      contact / contact_id: the n_predict_frames rows centered on the row
+    rows are dropped when the pair is farther than distance_threshold over the whole predict window,
+    negatives (no contact in the predict window) are down sampled (not test),
+    and items with too few images are dropped:
+      count_exist(pairs, pair_idx, frames) -> number of existing images of both views of every row
+      (pairs: game_play / nfl_player_id_1 / nfl_player_id_2 of each pair, pair_idx: pair of each row, frames: (n, F)).
+    random numbers are drawn in the same order as a per row loop, so a seed gives the same items as before.
+    returns (items, stats): items = ItemTable, stats = counts for logging.
+    """
+    df = df[df["contact"].notnull()]
+    if only_g:
+        df = df[df["nfl_player_id_2"] == "G"]
+    if feature_window > 0:
+        df = df.copy()
+        cols_log = [f"{col}_log" for col in feature_cols]
+        df[cols_log] = np.log1p(df[feature_cols].fillna(0)).replace(np.inf, 0).replace(-np.inf, 0).fillna(0)
+    n_total = len(df)
+
+    # rows grouped by pair (groupby order), row order kept inside a pair
+    w_df = df.drop_duplicates(PAIR_COLS + ["step"])
+    pair_idx = w_df.groupby(PAIR_COLS).ngroup().to_numpy()
+    order = np.argsort(pair_idx, kind="stable")
+    order = order[pair_idx[order] >= 0]
+    w_df = w_df.iloc[order].reset_index(drop=True)
+    pair_idx = pair_idx[order]
+    pairs = w_df[PAIR_COLS].drop_duplicates().reset_index(drop=True)
+
+    n = len(w_df)
+    sizes = np.bincount(pair_idx, minlength=len(pairs))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    rows = np.arange(n)
+    i = rows - starts[pair_idx]
+    size = sizes[pair_idx]
+
+    contact_ids = w_df["contact_id"].to_numpy()
+    frames = w_df["frame"].to_numpy()
+    contacts = w_df["contact"].to_numpy()
+    distances = w_df["distance"].fillna(0).to_numpy()
+    is_g = (w_df["nfl_player_id_2"] == "G").to_numpy().astype(int)
+
+    use = np.ones(n, dtype=bool) if test else (i % use_data_step == 0)
+    window = n_predict_frames // 2
+    use_window = use & (i - window >= 0) & (i + window + 1 <= size)
+    predict_indices = np.clip(rows[:, np.newaxis] + np.arange(-window, window + 1)[np.newaxis], 0, max(n - 1, 0))
+    use_window &= distances[predict_indices].min(axis=1, initial=np.inf) <= distance_threshold
+
+    # negative down sampling: one random number per negative candidate (+ one frame_adjust per used row before it)
+    negative = use_window & (contacts[predict_indices].sum(axis=1) == 0) if not test else np.zeros(n, dtype=bool)
+    rand = np.zeros(n)
+    adjust = np.zeros(n, dtype=np.int64)
+    np.random.seed(seed)
+    if frame_adjust > 0 and not test:
+        adjust_values = np.arange(-frame_adjust, frame_adjust + 1)
+        for row in np.where(use)[0]:
+            adjust[row] = int(np.random.choice(adjust_values))
+            if negative[row]:
+                rand[row] = np.random.random()
+    else:
+        rand[negative] = np.random.random(negative.sum())
+    ratio = np.where(
+        is_g == 1,
+        negative_sample_ratio_g,
+        np.where(distances < 0.75, negative_sample_ratio_close, negative_sample_ratio_far),
+    )
+    candidate = use_window & ~(negative & (rand > ratio))
+
+    half = n_frames // 2 * step
+    frame_offsets = np.arange(-half, half + 1, step)
+    rows_ = np.where(candidate)[0]
+    frame_indices = frames[rows_, np.newaxis] + frame_offsets[np.newaxis] + adjust[rows_, np.newaxis]
+    predict_indices = predict_indices[rows_]
+
+    exist = count_exist(pairs, pair_idx[rows_], frame_indices) >= n_frames * 2 * exist_image_threshold
+    exist[exist] = count_exist(
+        pairs, pair_idx[rows_[exist]], frames[predict_indices[exist]]
+    ) >= n_predict_frames * 2 * exist_center_image_threshold
+    n_failed = int((~exist).sum())
+    rows_ = rows_[exist]
+
+    contact = contacts
+    if soft_label_range is not None and not test:
+        contact = np.clip(contact, soft_label_range[0], soft_label_range[1])
+    if feature_window > 0:
+        features = w_df[cols_log].to_numpy()
+        assert len(np.arange(-(feature_window // 2), feature_window // 2 + 1)) == feature_window
+    else:
+        features = None
+
+    items = ItemTable(
+        pair_game_play=pairs["game_play"].to_numpy(dtype=object),
+        pair_id_1=pairs["nfl_player_id_1"].to_numpy(dtype=object),
+        pair_id_2=pairs["nfl_player_id_2"].to_numpy(dtype=object),
+        pair_start=starts,
+        pair_size=sizes.astype(np.int64),
+        row_contact_id=np.char.encode(np.asarray(contact_ids, dtype=str), "ascii"),
+        row_contact=contact,
+        row_frame=frames,
+        row_features=features,
+        row_distance=distances.astype(np.float32),
+        item_pair=pair_idx[rows_].astype(np.int32),
+        item_row=rows_.astype(np.int64),
+        item_adjust=adjust[rows_].astype(np.int16),
+        item_negative=(contacts[predict_indices[exist]].sum(axis=1) == 0),
+        frame_offsets=frame_offsets,
+        window=window,
+        feature_window=feature_window,
+    )
+    stats = {"total": n_total, "failed": n_failed, "is_g": int(is_g[rows_].sum())}
+    return items, stats
+
+
+class ItemTable:
+    """
+    NFLDataset items as fixed width arrays (no per item python objects: flat memory in forked DataLoader workers).
+      pair_*: one row per (game_play, id_1, id_2), whose rows are row_*[pair_start:pair_start + pair_size]
+      row_*: contact_id (ascii bytes) / contact / frame / features / distance of every row, shared by the items
+      item_*: pair, center row, frame_adjust and negative (no contact in the predict window, before soft labels)
+              of every item
+    items[k] rebuilds the item dict of the per row loop (contact_id, game_play, id_1, id_2, contact, frames,
+    features, is_g), items[slice or index array] is a sub table.
+    """
+    def __init__(self,
+                 pair_game_play: np.ndarray,
+                 pair_id_1: np.ndarray,
+                 pair_id_2: np.ndarray,
+                 pair_start: np.ndarray,
+                 pair_size: np.ndarray,
+                 row_contact_id: np.ndarray,
+                 row_contact: np.ndarray,
+                 row_frame: np.ndarray,
+                 row_features: np.ndarray,
+                 row_distance: np.ndarray,
+                 item_pair: np.ndarray,
+                 item_row: np.ndarray,
+                 item_adjust: np.ndarray,
+                 item_negative: np.ndarray,
+                 frame_offsets: np.ndarray,
+                 window: int,
+                 feature_window: int):
+        self.pair_game_play = pair_game_play
+        self.pair_id_1 = pair_id_1
+        self.pair_id_2 = pair_id_2
+        self.pair_start = pair_start
+        self.pair_size = pair_size
+        self.pair_is_g = np.array([id_2 == "G" for id_2 in pair_id_2], dtype=bool)
+        self.row_contact_id = row_contact_id
+        self.row_contact = row_contact
+        self.row_frame = row_frame
+        self.row_features = row_features
+        self.row_distance = row_distance
+        self.item_pair = item_pair
+        self.item_row = item_row
+        self.item_adjust = item_adjust
+        self.item_negative = item_negative
+        self.frame_offsets = frame_offsets
+        self.window = window
+        self.feature_window = feature_window
+
+    def __len__(self):
+        return len(self.item_row)
+
+    @property
+    def is_g(self):
+        return self.pair_is_g[self.item_pair].astype(int)
+
+    def contact(self, index=slice(None)):
+        """
+        (n, n_predict_frames) labels of the items `index` (all by default).
+        """
+        rows = self.item_row[index]
+        return self.row_contact[np.asarray(rows)[..., np.newaxis] + np.arange(-self.window, self.window + 1)]
+
+    def select(self, index):
+        ret = ItemTable.__new__(ItemTable)
+        ret.__dict__.update({
+            key: value[index] if key.startswith("item_") else value for key, value in self.__dict__.items()
+        })
+        return ret
+
+    def __getitem__(self, index):
+        if not isinstance(index, (int, np.integer)):
+            return self.select(index)
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        pair = self.item_pair[index]
+        row = self.item_row[index]
+        predict_rows = np.arange(row - self.window, row + self.window + 1)
+        if self.row_features is not None:
+            start = self.pair_start[pair]
+            half = self.feature_window // 2
+            rows = np.arange(row - half, row + half + 1)
+            inside = (rows >= start) & (rows < start + self.pair_size[pair])
+            features = self.row_features[np.clip(rows, start, start + self.pair_size[pair] - 1)]
+            features[~inside] = -1
+        else:
+            features = [0]
+        return {
+            "contact_id": np.char.decode(self.row_contact_id[predict_rows], "ascii"),
+            "game_play": self.pair_game_play[pair],
+            "id_1": self.pair_id_1[pair],
+            "id_2": self.pair_id_2[pair],
+            "contact": self.row_contact[predict_rows],
+            "frames": self.row_frame[row] + self.frame_offsets + self.item_adjust[index],
+            "features": features,
+            "is_g": int(self.pair_is_g[pair]),
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def items_key(df: pd.DataFrame, exist_fingerprint: str, params: dict):
+    """
+    cache key: content of the columns build_items reads + existence of the images + build_items parameters + ITEMS_VERSION
+    """
+    cols = PAIR_COLS + ["step", "contact_id", "frame", "contact", "distance"]
+    if params.get("feature_window", 0) > 0:
+        cols += list(params["feature_cols"])
+    key = {
+        "version": ITEMS_VERSION,
+        "data": fingerprint(df[cols]),
+        "exist": exist_fingerprint,
+        "params": {
+            k: list(v) if isinstance(v, (tuple, np.ndarray)) else v for k, v in params.items()
+            if k != "feature_cols" or params.get("feature_window", 0) > 0
+        },
+    }
+    return hashlib.md5(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_or_build_items(cache_dir: str,
+                        df: pd.DataFrame,
+                        count_exist: Callable,
+                        exist_fingerprint: str,
+                        **params):
+    """
+    build_items(df, count_exist, **params) cached in {cache_dir}/{items_key}.pickle.
+    exist_fingerprint identifies what count_exist sees (e.g. FrameIndex.fingerprint()).
+    the global numpy random state is left as build_items leaves it, cached or not.
+    """
+    path = f"{cache_dir}/{items_key(df, exist_fingerprint, params)}.pickle"
+    if os.path.isfile(path):
+        print(f"load items from {path}")
+        with open(path, "rb") as f:
+            items, stats, random_state = pickle.load(f)
+        np.random.set_state(random_state)
+        return items, stats
+
+    items, stats = build_items(df, count_exist, **params)
+    print(f"save items -> {path}")
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump((items, stats, np.random.get_state()), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp", path)
+    return items, stats
+
+
+class NegativeSampler:
+    """
+    per epoch negative down sampling over an ItemTable holding every negative (built with negative_sample_ratio_* = 1),
+    instead of rebuilding the dataset to draw new negatives.
+    strata: is_g x distance (< 0.75 / >= 0.75, not for G) x negative. positives are all kept, each negative stratum keeps
+    round(ratio * n) items drawn without replacement, so every epoch has the same length.
+    use as DataLoader(sampler=...) (indices are shuffled) and call set_epoch(epoch) before each epoch.
+    """
+    def __init__(self,
+                 items: ItemTable,
+                 negative_sample_ratio_close: float,
+                 negative_sample_ratio_far: float,
+                 negative_sample_ratio_g: float,
+                 seed: int = 0):
+        self.seed = seed
+        self.epoch = 0
+        is_g = items.is_g == 1
+        close = items.row_distance[items.item_row] < 0.75
+        negative = items.item_negative
+        self.positives = np.where(~negative)[0]
+        self.strata = [
+            (np.where(negative & is_g)[0], negative_sample_ratio_g),
+            (np.where(negative & ~is_g & close)[0], negative_sample_ratio_close),
+            (np.where(negative & ~is_g & ~close)[0], negative_sample_ratio_far),
+        ]
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    @staticmethod
+    def _n_draw(indices: np.ndarray, ratio: float):
+        return min(len(indices), int(round(ratio * len(indices))))
+
+    def indices(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        ret = [self.positives] + [
+            rng.choice(indices, size=self._n_draw(indices, ratio), replace=False) for indices, ratio in self.strata
+        ]
+        ret = np.concatenate(ret)
+        rng.shuffle(ret)
+        return ret
+
+    def __iter__(self):
+        return iter(self.indices().tolist())
+
+    def __len__(self):
+        return len(self.positives) + sum(self._n_draw(indices, ratio) for indices, ratio in self.strata)
+
+
+class PlayBatchSampler:
+    """
+    batches of consecutive items of a game_play in frame order, for render_on_the_fly: a DataLoader worker gets a whole
+    batch, so the items it renders one after the other share the video frames cached by CropRenderer.
+    every epoch the play order, the ties inside a play and the batch order are shuffled.
+    `sampler`: the items of an epoch (NegativeSampler.indices()), every item if None.
+    use as DataLoader(batch_sampler=...) and call set_epoch(epoch) before each epoch.
+    """
+    def __init__(self,
+                 items: ItemTable,
+                 batch_size: int,
+                 sampler: NegativeSampler = None,
+                 drop_last: bool = True,
+                 seed: int = 0):
+        self.items = items
+        self.batch_size = batch_size
+        self.sampler = sampler
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        if self.sampler is not None:
+            self.sampler.set_epoch(epoch)
+
+    def batches(self):
+        indices = np.arange(len(self.items)) if self.sampler is None else np.asarray(self.sampler.indices())
+        rng = np.random.default_rng([self.seed, self.epoch, 1])
+        _, play = np.unique(self.items.pair_game_play[self.items.item_pair[indices]], return_inverse=True)
+        play_order = rng.permutation(play.max() + 1 if len(play) > 0 else 0)
+        frame = self.items.row_frame[self.items.item_row[indices]] + self.items.item_adjust[indices]
+        indices = indices[np.lexsort((rng.random(len(indices)), frame, play_order[play]))]
+        batches = [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield batch.tolist()
+
+    def __len__(self):
+        n = len(self.items) if self.sampler is None else len(self.sampler)
+        return n // self.batch_size if self.drop_last else -(-n // self.batch_size)
@@ -0,0 +1,58 @@
+import time
+import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Tuple
+from .master_data import read_manifest, write_manifest
+
+
+def _run_unit(func: Callable, unit: str, args: tuple):
+    start = time.time()
+    result = func(*args)
+    return unit, result, time.time() - start
+
+
+def run_resumable(func: Callable,
+                  jobs: Dict[str, Tuple[str, tuple]],
+                  manifest_dir: str,
+                  n_jobs: int = 4,
+                  count_key: str = "n_images"):
+    """
+    run func(*args) for every unit of `jobs` ({unit: (input_hash, args)}) on a process pool.
+    finished units are recorded in {manifest_dir}/manifest.json (result dict + elapsed sec) as soon as they complete,
+    units already in the manifest with the same input_hash are skipped -> an interrupted run restarts where it stopped.
+    func must be picklable (module level) and return a dict; result[count_key] / elapsed is reported as throughput.
+    returns the manifest.
+    """
+    manifest = read_manifest(manifest_dir)
+    todo = {unit: job for unit, job in jobs.items()
+            if unit not in manifest or manifest[unit]["input_hash"] != job[0]}
+    print(f"{len(todo)} / {len(jobs)} units to run ({len(jobs) - len(todo)} done)")
+    if len(todo) == 0:
+        return manifest
+
+    n_total = 0
+    elapsed_total = 0
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(_run_unit, func, unit, args) for unit, (input_hash, args) in todo.items()]
+        pbar = tqdm.tqdm(as_completed(futures), total=len(futures))
+        for future in pbar:
+            try:
+                unit, result, elapsed = future.result()
+            except Exception as e:
+                print(e)
+                continue
+            manifest[unit] = {
+                "input_hash": todo[unit][0],
+                "elapsed": elapsed,
+                **result,
+            }
+            write_manifest(manifest_dir, manifest)
+
+            n_total += result.get(count_key, 0)
+            elapsed_total += elapsed
+            pbar.set_postfix(
+                unit=unit,
+                per_sec=f"{result.get(count_key, 0) / max(elapsed, 1e-6):.0f}",
+                per_sec_worker=f"{n_total / max(elapsed_total, 1e-6):.0f}",
+            )
+    return manifest
@@ -0,0 +1,126 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import hashlib
+from typing import List
+from .schema import to_legacy
+
+
+def make_pairs(nfl_player_ids: List[str]):
+    """
+    All player pairs of a game_play in `itertools.combinations` order.
+    "G" always goes to nfl_player_id_2, otherwise nfl_player_id_1 < nfl_player_id_2 (as int).
+    returns two object arrays (player ids are int, "G" stays str) like the original loop did.
+    """
+    ids = np.asarray(nfl_player_ids, dtype=object)
+    idx_1, idx_2 = np.triu_indices(len(ids), k=1)
+    ids_1 = ids[idx_1]
+    ids_2 = ids[idx_2]
+
+    is_g_1 = ids_1 == "G"
+    is_g_2 = ids_2 == "G"
+
+    ids_int = np.zeros(len(ids), dtype=np.int64)
+    not_g = ids != "G"
+    ids_int[not_g] = ids[not_g].astype(np.int64)
+    min_id = np.minimum(ids_int[idx_1], ids_int[idx_2]).astype(object)
+    max_id = np.maximum(ids_int[idx_1], ids_int[idx_2]).astype(object)
+
+    player_id_1 = np.where(is_g_1, ids_2, np.where(is_g_2, ids_1, min_id))
+    player_id_2 = np.where(is_g_1, ids_1, np.where(is_g_2, ids_2, max_id))
+    return player_id_1, player_id_2
+
+
+def make_padding_rows(game_play: str,
+                      view: str,
+                      nfl_player_ids: List[str],
+                      step_min: int,
+                      step_max: int,
+                      n_pad: int = 20):
+    """
+    rows before/after the labeled steps for every player pair:
+    [step_min - n_pad, step_min) and [step_max, step_max + n_pad).
+    cartesian product of pairs x step offsets in one shot (pair-major, previous rows first).
+    """
+    player_id_1, player_id_2 = make_pairs(nfl_player_ids)
+    steps = np.concatenate([
+        np.arange(step_min - n_pad, step_min),
+        np.arange(step_max, step_max + n_pad),
+    ])
+    n_pairs = len(player_id_1)
+    n_steps = len(steps)
+
+    return pd.DataFrame({
+        "game_play": game_play,
+        "step": np.tile(steps, n_pairs),
+        "nfl_player_id_1": np.repeat(player_id_1, n_steps),
+        "nfl_player_id_2": np.repeat(player_id_2, n_steps),
+        "view": view,
+    })
+
+
+def fingerprint(*dfs: pd.DataFrame, version: str = ""):
+    """
+    content hash of the input rows (values + column names, index ignored).
+    """
+    h = hashlib.md5(version.encode())
+    for df in dfs:
+        h.update(",".join(map(str, df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def read_manifest(data_dir: str):
+    manifest_path = f"{data_dir}/manifest.json"
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(data_dir: str, manifest: dict):
+    # write to tmp -> rename so that an interrupted run never leaves a broken manifest
+    manifest_path = f"{data_dir}/manifest.json"
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def _concat(dfs: List[pd.DataFrame]):
+    # unify categories first, otherwise concat falls back to object columns
+    for col in dfs[0].columns:
+        if isinstance(dfs[0][col].dtype, pd.CategoricalDtype):
+            categories = pd.Index(sorted(set().union(*[df[col].cat.categories for df in dfs])))
+            for df in dfs:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(dfs).reset_index(drop=True)
+
+
+def load_master_data(data_dir: str,
+                     game_plays: List[str] = None,
+                     columns: List[str] = None,
+                     legacy: bool = True):
+    """
+    load master data written by master_data_v5 (game_play shards in the compact schema, all of them or only `game_plays`).
+    `data_dir` may also be a single feather file or a directory with the monolithic gps.feather of older versions.
+    legacy=True: decode ids/game_play/view/frame/contact_id to the str schema the experiment scripts use.
+    """
+    if os.path.isfile(data_dir):
+        df = pd.read_feather(data_dir, columns=columns)
+        if game_plays is not None:
+            df = df[df["game_play"].isin(game_plays)].reset_index(drop=True)
+        return to_legacy(df) if legacy else df
+
+    manifest = read_manifest(data_dir)
+    if len(manifest) == 0:
+        return load_master_data(f"{data_dir}/gps.feather", game_plays=game_plays, columns=columns, legacy=legacy)
+
+    if game_plays is None:
+        game_plays = manifest.keys()
+    dfs = [
+        pd.read_feather(f"{data_dir}/{manifest[game_play]['path']}", columns=columns)
+        for game_play in sorted(game_plays) if game_play in manifest
+    ]
+    df = _concat(dfs)
+    return to_legacy(df) if legacy else df
@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+import os
+import queue
+import threading
+from typing import Callable, Iterable, List, Tuple
+
+_STOP = object()
+
+
+class _Stage:
+    """
+    worker threads reading from `in_queue`. cv2 decode / draw / resize / imencode release the GIL,
+    so the stages run in parallel on threads and frames never have to be pickled.
+    """
+    def __init__(self, func, in_queue: queue.Queue, n_workers: int, errors: list, stop: threading.Event):
+        self.func = func
+        self.in_queue = in_queue
+        self.errors = errors
+        self.stop = stop
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(n_workers)]
+        for t in self.threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _STOP:
+                return
+            if self.stop.is_set():
+                continue  # drain so that the upstream never blocks
+            try:
+                self.func(item)
+            except Exception as e:
+                self.errors.append(e)
+                self.stop.set()
+
+    def close(self):
+        for _ in self.threads:
+            self.in_queue.put(_STOP)
+        for t in self.threads:
+            t.join()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+# a gap longer than this is skipped by seeking instead of grab()-ing every frame in between
+SEEK_GAP = 300
+
+
+def plan_frames(frames, frame_count: int, seek_gap: int = SEEK_GAP):
+    """
+    sorted needed frames -> list of (frame, n_grab, seek).
+    before reading `frame`: seek to it (seek=True) or grab() n_grab frames from the current position.
+    frames: needed frame indices (any iterable, duplicates / out of range ignored). None: every frame.
+    seek_gap: None -> never seek.
+    """
+    if frames is None:
+        needed = np.arange(frame_count)
+    else:
+        needed = np.unique(np.asarray(list(frames), dtype=np.int64))
+        needed = needed[(needed >= 0) & (needed < frame_count)]
+    plan = []
+    pos = 0
+    for frame in needed.tolist():
+        gap = frame - pos
+        if seek_gap is not None and gap > seek_gap:
+            plan.append((frame, 0, True))
+        else:
+            plan.append((frame, gap, False))
+        pos = frame + 1
+    return plan
+
+
+def read_video(video_path: str, frames=None, seek_gap: int = SEEK_GAP, stats: dict = None):
+    """
+    yields (frame, img) of every frame in `frames` (all frames if None) in frame order.
+    skipped frames are grab()-ed (no retrieve / color conversion), long gaps are seeked (see plan_frames).
+    stats: filled with n_frames / n_needed / n_grabbed / n_seeks / n_decoded (= grabbed + read,
+    frames decoded inside a seek to reach it from the previous keyframe are not counted).
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    plan = plan_frames(frames, frame_count, seek_gap=seek_gap)
+    if stats is not None:
+        stats.update({"n_frames": frame_count, "n_needed": len(plan), "n_grabbed": 0, "n_seeks": 0, "n_decoded": 0})
+    try:
+        for frame, n_grab, seek in plan:
+            if seek:
+                vidcap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            for _ in range(n_grab):
+                vidcap.grab()
+            it_worked, img = vidcap.read()
+            if stats is not None:
+                stats["n_seeks"] += int(seek)
+                stats["n_grabbed"] += n_grab
+                stats["n_decoded"] += n_grab + 1
+            if not it_worked:
+                break
+            yield frame, img
+    finally:
+        vidcap.release()
+
+
+def write_image(item: Tuple[str, object]):
+    out_fname, img = item
+    os.makedirs(os.path.dirname(out_fname), exist_ok=True)
+    cv2.imwrite(out_fname, img)
+
+
+def make_image_writer(codec):
+    """
+    writer for run_render_pipeline storing (out_fname, img) with `codec` (common.codecs).
+    """
+    def write(item: Tuple[str, object]):
+        out_fname, img = item
+        os.makedirs(os.path.dirname(out_fname), exist_ok=True)
+        with open(out_fname, "wb") as f:
+            f.write(codec.encode(img))
+    return write
+
+
+def run_render_pipeline(decoded: Iterable,
+                        render_frame: Callable[[int, object], List[Tuple[str, object]]],
+                        n_render_workers: int = 4,
+                        n_writers: int = 4,
+                        queue_size: int = 16,
+                        writer: Callable = write_image):
+    """
+    decode -> render -> encode/write with bounded queues.
+    decoded: iterable of (frame, img) (e.g. read_video), consumed on the calling thread.
+    render_frame(frame, img): list of (out_fname, img) for the crops of the frame.
+    writer((out_fname, img)): encodes and writes one crop (default: cv2.imwrite).
+    at most `queue_size` decoded frames and `queue_size` * n_render_workers crops are held in memory.
+    returns the number of written images.
+    """
+    errors = []
+    stop = threading.Event()
+    frame_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size * n_render_workers)
+    n_written = [0]
+    lock = threading.Lock()
+
+    def write(item):
+        writer(item)
+        with lock:
+            n_written[0] += 1
+
+    def render(item):
+        frame, img = item
+        for out in render_frame(frame, img):
+            _put(write_queue, out, stop)
+
+    writers = _Stage(write, write_queue, n_writers, errors, stop)
+    renderers = _Stage(render, frame_queue, n_render_workers, errors, stop)
+    try:
+        for item in decoded:
+            if stop.is_set():
+                break
+            _put(frame_queue, item, stop)
+    finally:
+        renderers.close()
+        writers.close()
+    if len(errors) > 0:
+        raise errors[0]
+    return n_written[0]
@@ -0,0 +1,290 @@
+import cv2
+import dataclasses
+import numpy as np
+import pandas as pd
+from typing import Tuple
+from .crop_geometry import load_game_plays, load_crop_geometry
+from .frames import LRUCache
+
+CONTACT = (192, 256, 0)
+AWAY = (0, 0, 0)
+HOME = (255, 255, 255)
+PLAYER = (192, 256, 0)
+
+# (left, right, top, down) * bbox_size around the pair center
+BBOX_RATIOS = (4.5, 4.5, 4.5, 2.25)
+
+
+def blend_boxes(img: np.ndarray,
+                boxes,
+                colors,
+                alpha: float,
+                inplace: bool = False):
+    """
+    same pixels as filling every box (cv2.rectangle(thickness=-1), in order) on a copy of img and
+    cv2.addWeighted(img, alpha, filled, 1 - alpha), without the full size filled image / blend:
+    pixels outside the boxes are unchanged, so only the box slices are blended.
+    boxes are visited last to first, each blending only the pixels no later box claimed (claimed mask over the
+    boxes' bounding region) -> overlaps are blended once, with the color of the last box.
+    boxes: (n, 4) int [x1, y1, x2, y2] (cv2.rectangle corners, inclusive, any order)
+    colors: (n, 3) per box
+    """
+    if not inplace:
+        img = img.copy()
+    h, w = img.shape[:2]
+    rects = []
+    for (bx1, by1, bx2, by2), color in zip(np.asarray(boxes).reshape(-1, 4).tolist(), colors):
+        x1 = min(max(min(bx1, bx2), 0), w)
+        x2 = min(max(max(bx1, bx2) + 1, 0), w)
+        y1 = min(max(min(by1, by2), 0), h)
+        y2 = min(max(max(by1, by2) + 1, 0), h)
+        if x1 < x2 and y1 < y2:
+            rects.append((x1, y1, x2, y2, [min(max(int(c), 0), 255) for c in color]))
+    if len(rects) == 0:
+        return img
+
+    claimed = None
+    if len(rects) > 1:
+        rx1 = min(r[0] for r in rects)
+        ry1 = min(r[1] for r in rects)
+        claimed = np.zeros((max(r[3] for r in rects) - ry1, max(r[2] for r in rects) - rx1), dtype=bool)
+    for x1, y1, x2, y2, color in rects[::-1]:
+        box = img[y1:y2, x1:x2]
+        filled = np.empty_like(box)
+        filled[:] = color
+        blended = cv2.addWeighted(src1=box, alpha=alpha, src2=filled, beta=1 - alpha, gamma=0)
+        if claimed is None:
+            box[:] = blended
+            continue
+        box_claimed = claimed[y1 - ry1:y2 - ry1, x1 - rx1:x2 - rx1]
+        if box_claimed.any():
+            np.copyto(box, blended, where=~box_claimed[..., np.newaxis])
+        else:
+            box[:] = blended
+        box_claimed[:] = True
+    return img
+
+
+def draw_frame_boxes(img: np.ndarray,
+                     bboxes: np.ndarray,
+                     color=PLAYER,
+                     alpha: float = 0.75,
+                     inplace: bool = False):
+    """
+    frame level overlay: every helmet box of the frame filled with `color`, blended with weight 1 - alpha.
+    bboxes: (n, 4) int [left, width, top, height]
+    """
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    boxes = np.stack([bboxes[:, 0], bboxes[:, 2], bboxes[:, 0] + bboxes[:, 1], bboxes[:, 2] + bboxes[:, 3]], axis=1)
+    return blend_boxes(img, boxes, [color] * len(boxes), alpha, inplace=inplace)
+
+
+def get_crop_box(series: pd.Series,
+                 bbox_ratios: Tuple[float, float, float, float] = BBOX_RATIOS):
+    """
+    (left, right, top, down) of the crop in frame pixels. top > down (slice is img[down:top, left:right]).
+    """
+    bbox_left_ratio, bbox_right_ratio, bbox_top_ratio, bbox_down_ratio = bbox_ratios
+    left = int(series["x"] - series["bbox_size"] * bbox_left_ratio)
+    right = int(series["x"] + series["bbox_size"] * bbox_right_ratio)
+    top = int(series["y"] + series["bbox_size"] * bbox_top_ratio)
+    down = int(series["y"] - series["bbox_size"] * bbox_down_ratio)
+
+    left = max(0, left)
+    down = max(0, down)
+    return left, right, top, down
+
+
+def get_pair_color(series: pd.Series, colors=(CONTACT, AWAY, HOME)):
+    """
+    colors: (contact with G, different teams, same team)
+    """
+    if series["nfl_player_id_2"] == "G":
+        return colors[0]
+    elif series["team_1"] != series["team_2"]:
+        return colors[1]
+    else:
+        return colors[2]
+
+
+def render_pair_crop(img_frame: np.ndarray,
+                     series: pd.Series,
+                     output_size: Tuple[int, int] = (128, 96),
+                     bbox_ratios: Tuple[float, float, float, float] = BBOX_RATIOS,
+                     alpha: float = 0.1,
+                     colors=(CONTACT, AWAY, HOME)):
+    """
+    crop of one player pair with its helmet boxes highlighted (pair color), resized to output_size.
+    the ROI is a view of `img_frame` (never modified): only the ROI is copied, only the box pixels are blended.
+    returns None when the pair has no center at this frame.
+    """
+    if np.isnan(series["x"]):
+        return None
+    left, right, top, down = get_crop_box(series, bbox_ratios)
+
+    img = img_frame[down:top, left:right]
+    boxes = []
+    for player_id in [1, 2]:
+        if series[f"nfl_player_id_{player_id}"] == "G":
+            continue
+        if np.isnan(series[f"left_{player_id}"]):
+            continue
+
+        box_left = max(0, int(series[f"left_{player_id}"]) - left)
+        box_right = max(min(img.shape[1], int(series[f"left_{player_id}"] + series[f"width_{player_id}"]) - left), 0)
+        box_top = max(0, int(series[f"top_{player_id}"]) - down)
+        box_down = max(min(img.shape[0], int(series[f"top_{player_id}"] + series[f"height_{player_id}"]) - down), 0)
+        boxes.append([box_left, box_top, box_right, box_down])
+
+    box_color = get_pair_color(series, colors)
+    img = blend_boxes(img, boxes, [box_color] * len(boxes), alpha)
+    return cv2.resize(img, dsize=output_size)
+
+
+@dataclasses.dataclass(frozen=True)
+class RenderSpec:
+    """
+    one output variant of the pair crop renderer (out_image_multi).
+    """
+    output_dir: str
+    output_size: Tuple[int, int] = (128, 96)
+    bbox_ratios: Tuple[float, float, float, float] = BBOX_RATIOS
+    contact_color: Tuple[int, int, int] = CONTACT
+    away_color: Tuple[int, int, int] = AWAY
+    home_color: Tuple[int, int, int] = HOME
+    player_color: Tuple[int, int, int] = PLAYER
+    frame_alpha: float = 0.75  # None: no frame level player overlay
+    pair_alpha: float = 0.1
+    grayscale: bool = False  # stored single channel (H, W)
+    canvas: int = None  # draw the overlays on a constant image of this value instead of the video frame
+    pack_original: bool = False  # stored as [crop without overlay, rendered crop] on the channel axis (H, W, 6 or 2)
+    output_format: str = "jpg"  # "jpg" (one file per crop) / "clips"
+    codec: str = "jpg"  # common.codecs name, e.g. "jpg:90", "png:1", "npy" (packed 6 channels: npy / lz4)
+
+    def frame_key(self):
+        return self.player_color, self.frame_alpha, self.canvas
+
+
+def render_frame_overlay(img_frame: np.ndarray, bboxes: np.ndarray, spec: RenderSpec, inplace: bool = False):
+    """
+    the frame the crops of `spec` are cut from: the video frame (or the canvas) with the frame level overlay.
+    """
+    if spec.canvas is not None:
+        img_frame = np.full_like(img_frame, spec.canvas)
+        inplace = True
+    if spec.frame_alpha is None:
+        return img_frame
+    return draw_frame_boxes(img_frame, bboxes, color=spec.player_color, alpha=spec.frame_alpha, inplace=inplace)
+
+
+def render_spec(img_frame: np.ndarray, series: pd.Series, spec: RenderSpec, img_original: np.ndarray = None):
+    """
+    render_pair_crop with the parameters of `spec`. img_frame: render_frame_overlay of spec,
+    img_original: the video frame without overlay (needed for pack_original).
+    """
+    img = render_pair_crop(
+        img_frame,
+        series,
+        output_size=spec.output_size,
+        bbox_ratios=spec.bbox_ratios,
+        alpha=spec.pair_alpha,
+        colors=(spec.contact_color, spec.away_color, spec.home_color),
+    )
+    if img is None:
+        return None
+    if spec.pack_original:
+        left, right, top, down = get_crop_box(series, spec.bbox_ratios)
+        img = np.concatenate([cv2.resize(img_original[down:top, left:right], dsize=spec.output_size), img], axis=2)
+    if spec.grayscale:
+        img = np.stack([
+            cv2.cvtColor(np.ascontiguousarray(img[:, :, i:i + 3]), cv2.COLOR_BGR2GRAY) for i in range(0, img.shape[2], 3)
+        ], axis=2)
+        if img.shape[2] == 1:
+            img = img[:, :, 0]
+    return img
+
+
+class CropRenderer:
+    """
+    renders the crops of a pair at read time (NFLDataset render_on_the_fly) instead of reading pre-rendered files.
+    frames come from `frame_source` (get_frames(game_play, view, frame_indices)), frames with the frame level
+    overlay already applied are kept in an LRU cache shared by all items (per process / DataLoader worker).
+    """
+    def __init__(self,
+                 geometry_dir: str,
+                 frame_source,
+                 spec: RenderSpec,
+                 frame_cache_size: int = 64,
+                 geometry_cache_size: int = 64):
+        self.geometry_dir = geometry_dir
+        self.frame_source = frame_source
+        self.spec = spec
+        self.frame_cache = LRUCache(frame_cache_size)
+        self.geometry_cache = LRUCache(geometry_cache_size)
+
+    def _geometry(self, game_play: str, view: str):
+        key = (game_play, view)
+        geometry = self.geometry_cache.get(key)
+        if geometry is None:
+            gp_ = load_crop_geometry(self.geometry_dir, game_play, view)
+            data_dict = {}
+            for pair, w_df in gp_.groupby(["nfl_player_id_1", "nfl_player_id_2"]):
+                data_dict[pair] = w_df.set_index("frame")
+            bbox_dict = {}
+            for frame, w_df in gp_.drop_duplicates(["frame", "nfl_player_id_1"]).groupby("frame"):
+                bbox_dict[frame] = w_df[["left_1", "width_1", "top_1", "height_1"]].dropna().values.astype(int)
+            geometry = (data_dict, bbox_dict)
+            self.geometry_cache.put(key, geometry)
+        return geometry
+
+    def frame_keys(self):
+        """
+        game_play, view, id_1, id_2, frame of every crop that can be rendered: NFLDataset filters items with it.
+        """
+        dfs = []
+        for game_play in load_game_plays(self.geometry_dir):
+            for view in ["Endzone", "Sideline"]:
+                gp_ = load_crop_geometry(self.geometry_dir, game_play, view)
+                gp_ = gp_[gp_["x"].notnull()]
+                dfs.append(pd.DataFrame({
+                    "game_play": game_play,
+                    "view": view,
+                    "id_1": gp_["nfl_player_id_1"].values,
+                    "id_2": gp_["nfl_player_id_2"].values,
+                    "frame": gp_["frame"].values.astype(int),
+                }))
+        return pd.concat(dfs, ignore_index=True)
+
+    def _frames(self, game_play: str, view: str, frames, bbox_dict: dict):
+        ret = {}
+        missing = []
+        for frame in frames:
+            img = self.frame_cache.get((game_play, view, frame))
+            if img is None:
+                missing.append(frame)
+            else:
+                ret[frame] = img
+        if len(missing) > 0:
+            for frame, img in self.frame_source.get_frames(game_play, view, missing).items():
+                img_frame = render_frame_overlay(img, bbox_dict[frame], self.spec, inplace=not self.spec.pack_original)
+                self.frame_cache.put((game_play, view, frame), (img_frame, img if self.spec.pack_original else None))
+                ret[frame] = (img_frame, img)
+        return ret
+
+    def render(self, game_play: str, view: str, id_1: str, id_2: str, frames):
+        """
+        crops of the pair for every frame (None where the pair has no box / the frame is not in the video).
+        """
+        ret = [None] * len(frames)
+        data_dict, bbox_dict = self._geometry(game_play, view)
+        w_df = data_dict.get((str(id_1), str(id_2)))
+        if w_df is None:
+            return ret
+        needed = [frame for frame in frames if frame in w_df.index]
+        img_frames = self._frames(game_play, view, needed, bbox_dict)
+        for i, frame in enumerate(frames):
+            if frame not in img_frames:
+                continue
+            img_frame, img_original = img_frames[frame]
+            ret[i] = render_spec(img_frame, w_df.loc[frame], self.spec, img_original=img_original)
+        return ret
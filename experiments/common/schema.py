@@ -0,0 +1,120 @@
+import pandas as pd
+import numpy as np
+
+# compact schema of the master data (gps.feather)
+#   nfl_player_id_1/2: int32, "G" -> G_PLAYER_ID
+#   game_play/view/team/position: category
+#   step/frame: int16, missing frame -> MISSING_FRAME
+#   float measurements: float32
+#   contact_id: not stored (rebuilt from game_play/step/ids with make_contact_id)
+G_PLAYER_ID = -1
+MISSING_FRAME = -1
+LEGACY_MISSING_FRAME = 99999
+
+ID_COLUMNS = ["nfl_player_id_1", "nfl_player_id_2"]
+CATEGORY_COLUMNS = ["game_play", "view", "team_1", "team_2", "position_1", "position_2"]
+INT16_COLUMNS = ["step", "frame"]
+INT32_COLUMNS = ["game_key"]
+
+
+def encode_player_id(values):
+    """
+    "G" / "12345" / 12345 -> int32 (G_PLAYER_ID for "G")
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.astype(np.int32)
+    codes, uniques = pd.factorize(values)
+    uniques = np.array([G_PLAYER_ID if x == "G" else int(x) for x in uniques], dtype=np.int32)
+    return uniques[codes]
+
+
+def decode_player_id(values):
+    """
+    int32 -> str ("G" for G_PLAYER_ID). str input is returned as is.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in "iu":
+        return values
+    codes, uniques = pd.factorize(values)
+    uniques = np.array(["G" if x == G_PLAYER_ID else str(x) for x in uniques], dtype=object)
+    return uniques[codes]
+
+
+def is_g(df: pd.DataFrame):
+    ids = df["nfl_player_id_2"].values
+    if ids.dtype.kind in "iu":
+        return ids == G_PLAYER_ID
+    return ids == "G"
+
+
+def player_id_sort_key(values: pd.Series):
+    """
+    sort_values(key=...): compact player ids sort like the str ids of the legacy schema ("G" last).
+    """
+    if values.name in ID_COLUMNS and values.dtype.kind in "iu":
+        return values.where(values != G_PLAYER_ID, np.iinfo(np.int32).max)
+    return values
+
+
+def make_contact_id(df: pd.DataFrame):
+    """
+    f"{game_play}_{step}_{nfl_player_id_1}_{nfl_player_id_2}" for both schemas.
+    formats only the unique (game_play, step) and (id_1, id_2) combinations instead of every row.
+    """
+    left_codes, left_uniques = pd.factorize(
+        pd.MultiIndex.from_arrays([df["game_play"].astype(str).values, df["step"].values])
+    )
+    right_codes, right_uniques = pd.factorize(
+        pd.MultiIndex.from_arrays([df["nfl_player_id_1"].values, df["nfl_player_id_2"].values])
+    )
+    left_str = np.array([f"{game_play}_{step}" for game_play, step in left_uniques], dtype=object)
+    right_str = np.array([
+        f"_{id_1}_{id_2}" for id_1, id_2 in zip(
+            decode_player_id(right_uniques.get_level_values(0)),
+            decode_player_id(right_uniques.get_level_values(1)),
+        )
+    ], dtype=object)
+    return left_str[left_codes] + right_str[right_codes]
+
+
+def to_compact(df: pd.DataFrame):
+    df = df.drop("contact_id", axis=1, errors="ignore")
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            df[col] = encode_player_id(df[col].values)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    if "frame" in df.columns:
+        df["frame"] = df["frame"].fillna(LEGACY_MISSING_FRAME)
+        df["frame"] = np.where(df["frame"].values == LEGACY_MISSING_FRAME, MISSING_FRAME, df["frame"].values)
+    for col in INT16_COLUMNS + INT32_COLUMNS:
+        if col in df.columns and df[col].notnull().all():
+            df[col] = df[col].astype(np.int16 if col in INT16_COLUMNS else np.int32)
+    for col in df.columns:
+        if df[col].dtype == np.float64:
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+def to_legacy(df: pd.DataFrame):
+    """
+    decode the key columns (ids, game_play, view, frame, contact_id) back to what the experiment scripts expect.
+    numeric columns keep their compact dtype. no-op for data which is already in the legacy schema.
+    """
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            df[col] = decode_player_id(df[col].values)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    if "frame" in df.columns and df["frame"].dtype == np.int16:
+        frame = df["frame"].values.astype(np.int32)
+        df["frame"] = np.where(frame == MISSING_FRAME, LEGACY_MISSING_FRAME, frame)
+    if "contact_id" not in df.columns and {"game_play", "step"}.issubset(df.columns) and set(ID_COLUMNS).issubset(df.columns):
+        contact_id = make_contact_id(df)
+        if "contact" in df.columns:
+            contact_id[df["contact"].isnull().values] = np.nan
+        df.insert(0, "contact_id", contact_id)
+    return df
@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+from typing import List
+
+
+class TrackingStore:
+    """
+    tracking of one game_play as dense (player slot, step) arrays.
+    pair rows pick up player columns by integer gather instead of merging the tracking table twice.
+    """
+    def __init__(self,
+                 df_tracking: pd.DataFrame,
+                 columns: List[str]):
+        self.columns = columns
+        self.players = pd.Index(df_tracking["nfl_player_id"].unique())
+        steps = df_tracking["step"].values.astype(np.int64)
+        self.step_min = steps.min() if len(steps) > 0 else 0
+        self.n_steps = (steps.max() - self.step_min + 1) if len(steps) > 0 else 0
+
+        slot = self.players.get_indexer(df_tracking["nfl_player_id"].values)
+        flat_idx = slot * self.n_steps + (steps - self.step_min)
+        size = len(self.players) * self.n_steps
+
+        self.exists = np.zeros(size, dtype=bool)
+        self.exists[flat_idx] = True
+        self.values = {}
+        for col in columns:
+            values = df_tracking[col].values
+            if values.dtype.kind in "iufb":
+                ary = np.full(size, np.nan, dtype=np.float64)
+            else:
+                ary = np.full(size, np.nan, dtype=object)
+            ary[flat_idx] = values
+            self.values[col] = ary
+
+    def lookup(self, nfl_player_ids: np.ndarray, steps: np.ndarray):
+        """
+        flat (player slot, step) index of every row and whether the player has tracking at that step.
+        """
+        slot = self.players.get_indexer(nfl_player_ids)
+        steps = np.asarray(steps, dtype=np.int64) - self.step_min
+        found = (slot >= 0) & (steps >= 0) & (steps < self.n_steps)
+        flat_idx = np.where(found, slot * self.n_steps + steps, 0)
+        if len(self.exists) > 0:
+            found &= self.exists[flat_idx]
+        else:
+            found[:] = False
+        return flat_idx, found
+
+    def gather(self, col: str, flat_idx: np.ndarray, found: np.ndarray):
+        if len(self.exists) == 0:
+            return np.full(len(flat_idx), np.nan)
+        ret = self.values[col][flat_idx]
+        ret[~found] = np.nan
+        return ret
+
+
+def join_tracking(gps: pd.DataFrame,
+                  df_tracking: pd.DataFrame,
+                  columns: List[str]):
+    """
+    attach `columns` of player 1 / player 2 (suffix _1/_2), game_key and the pairwise distance to the pair rows of one game_play.
+    same result as the two left merges on (game_play, step[, game_key]) in master_data_v4:
+    player 2 is only joined where player 1 has tracking (game_key comes from the player 1 merge).
+    """
+    store = TrackingStore(df_tracking, ["game_key"] + columns)
+    steps = gps["step"].values
+
+    flat_idx_1, found_1 = store.lookup(gps["nfl_player_id_1"].values, steps)
+    flat_idx_2, found_2 = store.lookup(gps["nfl_player_id_2"].values, steps)
+    found_2 &= found_1
+
+    gps = gps.copy()
+    game_key = store.gather("game_key", flat_idx_1, found_1)
+    gps["game_key"] = game_key.astype(np.int64) if found_1.all() and len(gps) > 0 else game_key
+    for col in columns:
+        gps[f"{col}_1"] = store.gather(col, flat_idx_1, found_1)
+    for col in columns:
+        gps[f"{col}_2"] = store.gather(col, flat_idx_2, found_2)
+
+    gps["distance"] = np.sqrt(
+        (gps["x_position_1"].values - gps["x_position_2"].values) ** 2 +
+        (gps["y_position_1"].values - gps["y_position_2"].values) ** 2
+    )
+    return gps
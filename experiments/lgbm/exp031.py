@@ -22,6 +22,11 @@ import warnings
 import json
 from catboost import CatBoost, Pool
 from scipy.misc import derivative
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.master_data import load_master_data
+from common.schema import make_contact_id, is_g, player_id_sort_key
+from common.dataset import split_fold, read_folds, read_partitioned, write_partitioned, has_schema
 
 warnings.filterwarnings("ignore")
 
@@ -161,21 +166,24 @@ class Model:
             "is_g": {},
         }
 
+    def get_feature_path(self, df: pd.DataFrame):
+        # partitioned by game_key/game_play (see common.dataset.write_partitioned)
+        return f"{self.feature_dir}/{os.path.basename(__file__).replace('.py', '')}/feature_len{len(df)}"
+
     def feature_engineering(self,
                             df: pd.DataFrame,
                             inference: bool = True):
         # all
         # df = df[df["distance"].fillna(0) <= 2]
-        feature_path = f"{self.feature_dir}/{os.path.basename(__file__).replace('.py', '')}/feature_len{len(df)}.feather"
-        json_path = f"{self.feature_dir}/{os.path.basename(__file__).replace('.py', '')}/feature_len{len(df)}.json"
-        if os.path.isfile(feature_path) and not inference and not self.debug:
+        feature_path = self.get_feature_path(df)
+        json_path = f"{feature_path}.json"
+        if has_schema(feature_path) and not inference and not self.debug:
             self.logger.info("load from feature_dir")
-            return pd.read_feather(feature_path)
+            return read_partitioned(feature_path)
         self.logger.info("Reduce memory usage")
         df = reduce_mem_usage(df)
 
-        df["contact_id"] = df["game_play"] + "_" + df["step"].astype(str) + "_" + df["nfl_player_id_1"].astype(
-            str) + "_" + df["nfl_player_id_2"].astype(str)
+        df["contact_id"] = make_contact_id(df)
 
         self.logger.info("FE1: all features")
 
@@ -191,7 +199,7 @@ class Model:
         df = df[["contact_id"]].drop_duplicates()
         df = pd.merge(df, df_endzone, how="left")
         df = pd.merge(df, df_sideline, how="left")
-        df = df.sort_values(["game_play", "step", "nfl_player_id_1", "nfl_player_id_2"])
+        df = df.sort_values(["game_play", "step", "nfl_player_id_1", "nfl_player_id_2"], key=player_id_sort_key)
         self.logger.info(f"[aggregate view]after: {df.shape}")
 
         self.logger.info("nearest_n_player")
@@ -270,8 +278,8 @@ class Model:
 
         df["move_sensor"] = df["distance_1"] + df["distance_2"]
 
-        df["is_same_team"] = df["team_1"] == df["team_2"]
-        df["is_g"] = df["nfl_player_id_2"] == "G"
+        df["is_same_team"] = df["team_1"].astype(object) == df["team_2"].astype(object)
+        df["is_g"] = is_g(df)
 
         for col in ["orientation", "direction"]:
             for col2 in ["acceleration", "speed"]:
@@ -474,7 +482,7 @@ class Model:
         if not inference:
             self.logger.info("save feather")
             os.makedirs(os.path.dirname(feature_path), exist_ok=True)
-            df.to_feather(feature_path)
+            write_partitioned(df, feature_path)
             with open(json_path, "w") as  f:
                 json.dump(self.agg_dict, f)
 
@@ -488,8 +496,12 @@ class Model:
               apply_focal_loss: bool = False,
               use_half_data: bool = False):
 
-        gkfold = GroupKFold(5)
-        df_fe = self.feature_engineering(df, inference=False)
+        feature_path = self.get_feature_path(df)
+        if has_schema(feature_path) and not self.debug:
+            self.logger.info("load from feature_dir")
+        else:
+            df_fe = self.feature_engineering(df, inference=False)
+            del df_fe; gc.collect()
         if df_label is None:
             if self.debug:
                 df_label = df
@@ -497,18 +509,12 @@ class Model:
                 df_label = pd.read_csv("../../input/nfl-player-contact-detection/train_labels.csv")
         df_label["game_key"] = [int(x.split("_")[0]) for x in df_label["contact_id"].values]
 
-        self.logger.info((df_fe.isnull().sum() / len(df_fe)).sort_values())
+        # read only the partitions of this fold
+        df_label_train, df_label_val = split_fold(df_label, fold=fold, key=key)
+        df_train, df_val = read_folds(feature_path, key, [df_label_train[key].values, df_label_val[key].values])
+        df_test = df[df[key].isin(df_label_val[key].values)]
 
-        for i, (train_idx, val_idx) in enumerate(gkfold.split(df_label, groups=df_label[key].values)):
-            if i != fold:
-                continue
-            df_label_train = df_label.iloc[train_idx]
-            df_label_val = df_label.iloc[val_idx]
-            df_train = df_fe[df_fe[key].isin(df_label_train[key].values)]
-            df_val = df_fe[df_fe[key].isin(df_label_val[key].values)]
-            df_test = df[df[key].isin(df_label_val[key].values)]
-            break
-        del df_fe; gc.collect()
+        self.logger.info((df_train.isnull().sum() / len(df_train)).sort_values())
 
         df_merge = pd.merge(
             df_label_val[["contact_id", "contact"]],
@@ -665,7 +671,8 @@ def main():
     os.makedirs(output_dir, exist_ok=True)
     shutil.copy(__file__, output_dir)
     logger = get_logger(output_dir)
-    df = pd.read_feather("../../output/preprocess/master_data_v4/gps.feather")
+    # compact schema (int32 ids, categories), contact_id is built in feature_engineering
+    df = load_master_data("../../output/preprocess/master_data_v5", legacy=False)
     if debug:
         df = df.head(300000)
 
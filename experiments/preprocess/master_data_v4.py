@@ -4,70 +4,10 @@ import os
 import numpy as np
 import tqdm
 import json
-from itertools import combinations
-
-def join_helmets_contact(game_play, labels, helmets, meta, view="Sideline", fps=59.94):
-    """
-    Joins helmets and labels for a given game_play. Results can be used for visualizing labels.
-    Returns a dataframe with the joint dataframe, duplicating rows if multiple contacts occur.
-    """
-    gp_labs = labels.query("game_play == @game_play").copy()
-    gp_helms = helmets.query("game_play == @game_play and view == @view").copy()
-
-    start_time = meta.query("game_play == @game_play and view == @view")[
-        "start_time"
-    ].values[0]
-
-    gp_helms["datetime"] = (
-        pd.to_timedelta(gp_helms["frame"] * (1 / fps), unit="s") + start_time
-    )
-    gp_helms["datetime"] = pd.to_datetime(gp_helms["datetime"], utc=True)
-    gp_helms["datetime_ngs"] = (
-        pd.DatetimeIndex(gp_helms["datetime"] + pd.to_timedelta(50, "ms"))
-            .floor("100ms")
-            .values
-    )
-    gp_helms["datetime_ngs"] = pd.to_datetime(gp_helms["datetime_ngs"], utc=True)
-    gp_labs["datetime_ngs"] = pd.to_datetime(gp_labs["datetime"], utc=True)
-
-    # TODO: helmetも player_1, player_2 ごとに抽出
-    helmet_columns = [
-        "frame", "datetime_ngs", "datetime", "view", "nfl_player_id", "left", "width", "top", "height",
-        "x", "y", "team"
-    ]
-    gp = pd.merge(
-        gp_labs[["contact_id", "game_play", "step", "nfl_player_id_1", "nfl_player_id_2", "datetime_ngs", "contact"]],
-        gp_helms[helmet_columns].rename(
-            columns={col: f"{col}_1" if col not in ["frame", "datetime_ngs", "datetime", "view"] else col for col in helmet_columns}
-        ),
-        how="left",
-    )
-    gp = pd.merge(
-        gp,
-        gp_helms[helmet_columns].rename(
-            columns={col: f"{col}_2" if col not in ["frame", "datetime_ngs", "datetime", "view"] else col for col in helmet_columns}
-        ),
-        how="left",
-    )
-    gp["diff"] = np.abs(gp["datetime"] - gp["datetime_ngs"])
-    gp["rank"] = gp.groupby(["contact_id", "nfl_player_id_1", "nfl_player_id_2"])["diff"].rank(method="first")
-    gp = gp[(gp["rank"] == 1) | (gp["rank"].isnull())]
-    gp["datetime"] = gp["datetime_ngs"]
-
-    gp_ret = []
-    for key, gp_ in gp.groupby(["datetime_ngs"]):
-        frame = np.round(gp_["frame"].mean())
-        gp_["frame"] = gp_["frame"].fillna(frame)
-        gp_ret.append(gp_)
-    gp = pd.concat(gp_ret)
-    gp["frame"] = gp["frame"].fillna(0).astype(int)
-    gp = gp.drop(["datetime_ngs", "diff", "rank"], axis=1)
-    gp = gp[gp["frame"].notnull()]
-
-    gp["game_play"] = gp["game_play"].fillna(game_play)
-    gp["view"] = gp["view"].fillna(view)
-    return gp
-
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.helmets import densify_helmets, join_helmets_contact
+from common.master_data import make_padding_rows
 
 base_dir = "../../input/nfl-player-contact-detection"
 
@@ -85,25 +25,7 @@ df_helmets["team"] = [x[0] for x in df_helmets["player_label"].values]
 df_tracking["nfl_player_id"] = df_tracking["nfl_player_id"].astype(str)
 game_plays = df_labels["game_play"].drop_duplicates().values
 
-df_helmets_concat = []
-for key, df_ in tqdm.tqdm(df_helmets.groupby(["game_play", "view", "nfl_player_id"])):
-    frame_min = df_["frame"].min()
-    frame_max = df_["frame"].max()
-    game_play = key[0]
-    view = key[1]
-    nfl_player_id = key[2]
-
-    df_ = pd.merge(
-        pd.DataFrame({"frame": np.arange(frame_min, frame_max + 1)}).astype(int),
-        df_,
-        how="left"
-    )
-    df_["game_play"] = game_play
-    df_["nfl_player_id"] = nfl_player_id
-    df_["view"] = view
-    df_helmets_concat.append(df_)
-
-df_helmets = pd.concat(df_helmets_concat)
+df_helmets = densify_helmets(df_helmets, keys=["game_play", "view", "nfl_player_id"])
 
 gps = []
 
@@ -117,36 +39,7 @@ for key, w_df_helms in tqdm.tqdm(df_helmets.groupby(["game_play", "view"])):
         nfl_player_ids = df_labels[df_labels["game_play"] == game_play]["nfl_player_id_1"].drop_duplicates().values
         step_min, step_max = gp["step"].min(), gp["step"].max()
 
-        for players in combinations(nfl_player_ids, 2):
-            if players[0] == "G":
-                player_id_1 = players[1]
-                player_id_2 = players[0]
-            elif players[1] == "G":
-                player_id_1 = players[0]
-                player_id_2 = players[1]
-            else:
-                player_id_1 = min([int(players[0]), int(players[1])])
-                player_id_2 = max([int(players[0]), int(players[1])])
-
-            # previous
-            gp_ = pd.DataFrame({
-                "game_play": game_play,
-                "step": np.arange(step_min-20, step_min),
-            })
-            gp_["nfl_player_id_1"] = player_id_1
-            gp_["nfl_player_id_2"] = player_id_2
-            gp_["view"] = view
-            gps.append(gp_)
-
-            # next
-            gp_ = pd.DataFrame({
-                "game_play": game_play,
-                "step": np.arange(step_max, step_max+20),
-            })
-            gp_["nfl_player_id_1"] = player_id_1
-            gp_["nfl_player_id_2"] = player_id_2
-            gp_["view"] = view
-            gps.append(gp_)
+        gps.append(make_padding_rows(game_play, view, nfl_player_ids, step_min, step_max, n_pad=20))
 
     except Exception as e:
         print(e)
@@ -0,0 +1,134 @@
+import pandas as pd
+import os
+import numpy as np
+import tqdm
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.helmets import densify_helmets, join_helmets_contact
+from common.master_data import make_padding_rows, fingerprint, read_manifest, write_manifest
+from common.schema import to_compact
+from common.tracking import join_tracking
+
+# master_data_v4 の game_play 単位並列 & 差分ビルド版
+base_dir = "../../input/nfl-player-contact-detection"
+output_dir = "../../output/preprocess/master_data_v5"
+traintest = "train"
+n_jobs = os.cpu_count()
+
+# bump when the per game_play logic changes -> every shard is rebuilt
+BUILDER_VERSION = "v5.1"
+
+tracking_columns = [
+    "position", "x_position", "y_position", "speed", "distance", "direction", "orientation", "acceleration", "sa", "team"
+]
+
+
+def build_game_play(game_play, df_labels, df_helmets, df_tracking, df_meta):
+    """
+    master_data_v4 for a single game_play. all inputs are already filtered by game_play.
+    """
+    df_helmets = densify_helmets(df_helmets, keys=["game_play", "view", "nfl_player_id"])
+
+    gps = []
+    for view, w_df_helms in df_helmets.groupby("view"):
+        try:
+            gp = join_helmets_contact(game_play, df_labels, w_df_helms, df_meta, view=view).drop(["team_1", "team_2"], axis=1)
+            gps.append(gp)
+
+            nfl_player_ids = df_labels["nfl_player_id_1"].drop_duplicates().values
+            step_min, step_max = gp["step"].min(), gp["step"].max()
+
+            gps.append(make_padding_rows(game_play, view, nfl_player_ids, step_min, step_max, n_pad=20))
+        except Exception as e:
+            print(game_play, view, e)
+
+    gps = pd.concat(gps).sort_values(["game_play", "nfl_player_id_1", "nfl_player_id_2", "step"])
+    gps["nfl_player_id_1"] = gps["nfl_player_id_1"].astype(str)
+    gps["nfl_player_id_2"] = gps["nfl_player_id_2"].astype(str)
+
+    gps = join_tracking(gps, df_tracking, tracking_columns)
+    gps["frame"] = gps["frame"].fillna(99999).astype(int)
+    return to_compact(gps.reset_index(drop=True))
+
+
+def build_shard(game_play, df_labels, df_helmets, df_tracking, df_meta, shard_path):
+    gps = build_game_play(game_play, df_labels, df_helmets, df_tracking, df_meta)
+    gps.to_feather(f"{shard_path}.tmp")
+    os.replace(f"{shard_path}.tmp", shard_path)
+    return game_play, len(gps)
+
+
+def main():
+    df_labels = pd.read_csv(f"{base_dir}/{traintest}_labels.csv", parse_dates=["datetime"])
+    df_meta = pd.read_csv(f"{base_dir}/{traintest}_video_metadata.csv", parse_dates=["start_time", "end_time", "snap_time"])
+    df_tracking = pd.read_csv(f"{base_dir}/{traintest}_player_tracking.csv", parse_dates=["datetime"])
+    df_helmets = pd.read_csv(f"{base_dir}/{traintest}_baseline_helmets.csv")
+    df_tracking["datetime"] = pd.to_datetime(df_tracking["datetime"], utc=True)
+
+    df_labels["nfl_player_id_1"] = df_labels["nfl_player_id_1"].astype(str)
+    df_helmets["nfl_player_id"] = df_helmets["nfl_player_id"].astype(str)
+    df_helmets["x"] = df_helmets["left"] + df_helmets["width"] / 2
+    df_helmets["y"] = df_helmets["top"] + df_helmets["height"] / 2
+    df_helmets["team"] = [x[0] for x in df_helmets["player_label"].values]
+    df_tracking["nfl_player_id"] = df_tracking["nfl_player_id"].astype(str)
+
+    os.makedirs(f"{output_dir}/shards", exist_ok=True)
+    manifest = read_manifest(output_dir)
+
+    inputs = {}
+    helmets_dict = dict(tuple(df_helmets.groupby("game_play")))
+    tracking_dict = dict(tuple(df_tracking.groupby("game_play")))
+    meta_dict = dict(tuple(df_meta.groupby("game_play")))
+    for game_play, w_df_labels in df_labels.groupby("game_play"):
+        if game_play not in helmets_dict:
+            continue
+        inputs[game_play] = (
+            w_df_labels,
+            helmets_dict[game_play],
+            tracking_dict.get(game_play, df_tracking.iloc[:0]),
+            meta_dict.get(game_play, df_meta.iloc[:0]),
+        )
+
+    # shards of game_plays which are not in the inputs anymore
+    for game_play in set(manifest.keys()) - set(inputs.keys()):
+        shard_path = f"{output_dir}/{manifest[game_play]['path']}"
+        if os.path.isfile(shard_path):
+            os.remove(shard_path)
+        del manifest[game_play]
+
+    jobs = {}
+    for game_play, dfs in inputs.items():
+        input_hash = fingerprint(*dfs, version=BUILDER_VERSION)
+        path = f"shards/{game_play}.feather"
+        if (
+            game_play in manifest and
+            manifest[game_play]["input_hash"] == input_hash and
+            os.path.isfile(f"{output_dir}/{path}")
+        ):
+            continue
+        jobs[game_play] = (input_hash, path)
+    print(f"{len(jobs)} / {len(inputs)} game_plays to build")
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [
+            executor.submit(build_shard, game_play, *inputs[game_play], f"{output_dir}/{path}")
+            for game_play, (input_hash, path) in jobs.items()
+        ]
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            try:
+                game_play, n_rows = future.result()
+            except Exception as e:
+                print(e)
+                continue
+            manifest[game_play] = {
+                "input_hash": jobs[game_play][0],
+                "path": jobs[game_play][1],
+                "n_rows": n_rows,
+            }
+            write_manifest(output_dir, manifest)
+    write_manifest(output_dir, manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,27 @@
 import cv2
 import pandas as pd
 import os
+import json
+import hashlib
 import numpy as np
 import tqdm
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.frames import write_frames
+from common.jobs import run_resumable
 
 
-output_dir = f"../../output/preprocess/images/images_full"
+# full frame store (common.frames.FrameStore): {output_dir}/{game_play}/{view}.bin / .index.feather
+output_dir = f"../../output/preprocess/images/frames_full"
 traintest = "train"
+# storage codec (common.codecs) and downscale of the stored frames (1.0: video resolution, needed by CropRenderer)
+codec = "jpg"
+scale = 1.0
+# frames per chunk (unit of a read)
+chunk_size = 32
+
+n_jobs = 4
+n_writers = 2
 
 
 def load_video(video_path):
@@ -68,17 +83,27 @@ def main():
 
     game_plays = df_labels["game_play"].drop_duplicates().values
 
-    for game_play in tqdm.tqdm(game_plays):
+    input_hash = hashlib.md5(json.dumps({
+        "codec": codec,
+        "scale": scale,
+        "chunk_size": chunk_size,
+    }).encode()).hexdigest()
+    jobs = {}
+    for game_play in game_plays:
         for view in ["Endzone", "Sideline"]:
             video_path = f"{base_dir}/{traintest}/{game_play}_{view}.mp4"
-            vidcap = cv2.VideoCapture(video_path)
-            frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
-            for frame in range(frame_count):
-                it_worked, img = vidcap.read()
-                out_fname = f"{output_dir}/{game_play}/{view}/{frame}.jpg"
-                os.makedirs(os.path.dirname(out_fname), exist_ok=True)
-                cv2.imwrite(out_fname, img)
-            vidcap.release()
+            jobs[f"{game_play}_{view}"] = (
+                input_hash,
+                (video_path, f"{output_dir}/{game_play}/{view}", None, codec, chunk_size, scale, n_writers),
+            )
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = run_resumable(write_frames, jobs, output_dir, n_jobs=n_jobs)
+
+    stats = pd.DataFrame([manifest[unit] for unit in jobs.keys() if unit in manifest])
+    if len(stats) > 0:
+        print(f"frames / sec (per worker): {stats['n_images'].sum() / max(1e-6, stats['elapsed'].sum()):.1f}")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,165 @@
+import pandas as pd
+import os
+import json
+import hashlib
+import dataclasses
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.crop_geometry import prepare_crop_geometry, load_game_plays, load_crop_geometry
+from common.render import RenderSpec, render_frame_overlay, render_spec
+from common.pipeline import read_video, run_render_pipeline, make_image_writer
+from common.codecs import get_codec
+from common.clips import ClipWriter
+from common.jobs import run_resumable
+from common.frame_index import write_video_keys, build_frame_index
+
+# every video is decoded once and all specs are rendered from the same frame.
+# crop centers / boxes come from the shared crop geometry (same as out_image_128x96_v45).
+work_dir = "../../../work"
+SPECS = [
+    # = out_image_128x96_v45
+    RenderSpec(output_dir=f"{work_dir}/images_128x96_multi_v45"),
+    # 3 color team coding of v21 (pair alpha 0.5)
+    RenderSpec(
+        output_dir=f"{work_dir}/images_128x96_multi_team3",
+        contact_color=(0, 0, 0),
+        away_color=(0, 78, 255),
+        home_color=(255, 255, 255),
+        player_color=(255, 0, 0),
+        pair_alpha=0.5,
+    ),
+    RenderSpec(output_dir=f"{work_dir}/images_96x72_multi_v45", output_size=(96, 72)),
+    RenderSpec(output_dir=f"{work_dir}/images_192x144_multi_v45", output_size=(192, 144)),
+    RenderSpec(output_dir=f"{work_dir}/images_128x96_multi_gray", grayscale=True),
+    # channel_6 (v34 layout: crop + overlay only on a gray canvas) as one (H, W, 6) array per crop
+    RenderSpec(
+        output_dir=f"{work_dir}/images_128x96_multi_6ch",
+        contact_color=(0, 0, 0),
+        away_color=(128, 128, 255),
+        home_color=(128, 255, 128),
+        player_color=(255, 128, 128),
+        frame_alpha=0,
+        pair_alpha=0,
+        canvas=128,
+        pack_original=True,
+        output_format="clips",
+        codec="npy",
+    ),
+]
+manifest_dir = f"{work_dir}/out_image_multi"
+traintest = "train"
+
+n_jobs = 4
+n_render_workers = 2
+n_writers = 2
+queue_size = 16
+
+
+def render_video(geometry_dir, game_play, view, video_path, specs):
+    gp_ = load_crop_geometry(geometry_dir, game_play, view)
+
+    data_dict = {}
+    for key, w_df in gp_.groupby(["nfl_player_id_1", "nfl_player_id_2"]):
+        w_df = w_df.set_index("frame")
+        data_dict[key] = w_df
+
+    bbox_dict = {}
+    for key, w_df in gp_.drop_duplicates(["frame", "nfl_player_id_1"]).groupby("frame"):
+        bbox_dict[key] = w_df[["left_1", "width_1", "top_1", "height_1"]].dropna().values.astype(int)
+
+    frames = gp_["frame"].drop_duplicates().values
+
+    clip_writers = {}
+    image_writers = {}
+    for i, spec in enumerate(specs):
+        if spec.output_format == "clips":
+            clip_writers[i] = ClipWriter(f"{spec.output_dir}/{game_play}/{view}", codec=spec.codec)
+        else:
+            image_writers[i] = (make_image_writer(get_codec(spec.codec)), get_codec(spec.codec).ext)
+
+    keys = [[] for _ in specs]
+
+    def writer(item):
+        spec_idx, (id_1, id_2, frame), img = item
+        if spec_idx in clip_writers:
+            clip_writers[spec_idx].add_image(id_1, id_2, frame, img)
+        else:
+            write, ext = image_writers[spec_idx]
+            write((f"{specs[spec_idx].output_dir}/{game_play}/{view}/{id_1}_{id_2}_{frame}{ext}", img))
+
+    def render_frame(frame, img_):
+        # frame level overlay: once per distinct (player color, alpha, canvas)
+        img_frames = {}
+        for spec in specs:
+            if spec.frame_key() not in img_frames:
+                img_frames[spec.frame_key()] = render_frame_overlay(img_, bbox_dict[frame], spec)
+
+        ret = []
+        for key, w_df in data_dict.items():
+            if not frame in w_df.index:
+                continue
+            series = w_df.loc[frame]
+            for i, spec in enumerate(specs):
+                img = render_spec(img_frames[spec.frame_key()], series, spec, img_original=img_)
+                if img is None:
+                    continue
+                keys[i].append((key[0], key[1], frame))
+                ret.append((i, (key[0], key[1], frame), img))
+        return ret
+
+    stats = {}
+    n_images = run_render_pipeline(
+        read_video(video_path, frames=frames, stats=stats),
+        render_frame,
+        n_render_workers=n_render_workers,
+        n_writers=n_writers,
+        queue_size=queue_size,
+        writer=writer,
+    )
+    for clip_writer in clip_writers.values():
+        clip_writer.close()
+    for i, spec in enumerate(specs):
+        write_video_keys(f"{spec.output_dir}/{game_play}/{view}", keys[i])
+    return {"n_images": n_images, **stats}
+
+
+def main():
+    base_dir = "../../input/nfl-player-contact-detection"
+
+    geometry_dir = prepare_crop_geometry(
+        base_dir,
+        traintest=traintest,
+        master_data_path="../../output/preprocess/master_data_v3/gps.feather",
+        distance_threshold=1.5,
+        interpolate_limit=10,
+    )
+    game_plays = load_game_plays(geometry_dir)
+
+    # a unit (all specs of one video) is redone when the crop geometry or any spec changes
+    input_hash = hashlib.md5(json.dumps({
+        "geometry": os.path.basename(geometry_dir),
+        "specs": [dataclasses.asdict(spec) for spec in SPECS],
+    }).encode()).hexdigest()
+    jobs = {}
+    for game_play in game_plays:
+        for view in ["Endzone", "Sideline"]:
+            video_path = f"{base_dir}/{traintest}/{game_play}_{view}.mp4"
+            jobs[f"{game_play}_{view}"] = (input_hash, (geometry_dir, game_play, view, video_path, SPECS))
+
+    os.makedirs(manifest_dir, exist_ok=True)
+    for spec in SPECS:
+        os.makedirs(spec.output_dir, exist_ok=True)
+    manifest = run_resumable(render_video, jobs, manifest_dir, n_jobs=n_jobs)
+    # existence index of every rendered crop (NFLDataset)
+    for spec in SPECS:
+        build_frame_index(spec.output_dir)
+
+    read_stats = pd.DataFrame([manifest[unit] for unit in jobs.keys() if unit in manifest])
+    if len(read_stats) > 0:
+        print(f"specs: {len(SPECS)}")
+        print(f"decoded / needed: {read_stats['n_decoded'].sum() / max(1, read_stats['n_needed'].sum()):.3f}")
+        print(f"images / sec (per worker): {read_stats['n_images'].sum() / max(1e-6, read_stats['elapsed'].sum()):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+benchmark of the storage codecs of rendered crops (experiments/common/codecs.py).
+crops are rendered from the frames of a sample play (or synthetic frames), written with every codec and read back.
+reports encode MB/s (raw pixels), decode images/s (from disk, as NFLDataset.imread does), bytes/image and PSNR.
+
+python tools/bench_codecs.py [video.mp4] [codec ...]
+"""
+import cv2
+import numpy as np
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "experiments"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.codecs import get_codec, read_image, CODECS
+from common.render import render_pair_crop
+from bench_crop_render import load_frames, make_pairs
+
+default_codecs = ["jpg:95", "jpg:90", "jpg:75", "png:1", "png:3", "npy"] + (["lz4"] if "lz4" in CODECS else [])
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return np.inf if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1].endswith(".mp4") else None
+    codecs = [x for x in sys.argv[1:] if not x.endswith(".mp4")] or default_codecs
+
+    crops = [render_pair_crop(img, series) for img in load_frames(video_path) for series in make_pairs()]
+    raw_mb = sum(crop.nbytes for crop in crops) / 1e6
+    print(f"{len(crops)} crops {crops[0].shape}, {raw_mb:.1f}MB raw")
+    print(f"{'codec':>8} {'enc MB/s':>9} {'dec img/s':>10} {'bytes/img':>10} {'ratio':>6} {'psnr':>6}")
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name in codecs:
+            codec = get_codec(name)
+            start = time.perf_counter()
+            bufs = [codec.encode(crop) for crop in crops]
+            enc_time = time.perf_counter() - start
+
+            paths = []
+            for i, buf in enumerate(bufs):
+                path = f"{tmp_dir}/{name.replace(':', '_')}_{i}{codec.ext}"
+                with open(path, "wb") as f:
+                    f.write(buf)
+                paths.append(path)
+
+            start = time.perf_counter()
+            decoded = [read_image(path) for path in paths]
+            dec_time = time.perf_counter() - start
+
+            size = sum(len(buf) for buf in bufs)
+            quality = min(psnr(a, b) for a, b in zip(crops, decoded))
+            print(f"{name:>8} {raw_mb / enc_time:9.1f} {len(crops) / dec_time:10.0f} {size / len(crops):10.0f} "
+                  f"{raw_mb * 1e6 / size:6.1f} {quality:6.1f}")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
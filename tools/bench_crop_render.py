@@ -0,0 +1,132 @@
+"""
+benchmark of the pair crop renderer of the out_image scripts.
+legacy: full frame copy per pair -> crop -> overlay (out_image_128x96_v45 before common.render)
+roi: common.render.render_pair_crop (overlay on the ROI only)
+checks that both paths encode to the same jpg bytes.
+
+python tools/bench_crop_render.py [video.mp4]
+"""
+import cv2
+import numpy as np
+import pandas as pd
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "experiments"))
+from common.render import BBOX_RATIOS, CONTACT, AWAY, HOME, render_pair_crop
+
+frame_size = (1280, 720)
+n_frames = 16
+n_pairs = 60
+output_size = (128, 96)
+
+
+def render_pair_crop_legacy(img_, series):
+    bbox_left_ratio, bbox_right_ratio, bbox_top_ratio, bbox_down_ratio = BBOX_RATIOS
+    img = img_.copy()
+    left = int(series["x"] - series["bbox_size"] * bbox_left_ratio)
+    right = int(series["x"] + series["bbox_size"] * bbox_right_ratio)
+    top = int(series["y"] + series["bbox_size"] * bbox_top_ratio)
+    down = int(series["y"] - series["bbox_size"] * bbox_down_ratio)
+
+    left = max(0, left)
+    down = max(0, down)
+
+    img = img[down:top, left:right]
+    img_filter = img.copy()
+    for player_id in [1, 2]:
+        if series[f"nfl_player_id_{player_id}"] == "G":
+            continue
+        if np.isnan(series[f"left_{player_id}"]):
+            continue
+
+        if series[f"nfl_player_id_2"] == "G":
+            box_color = CONTACT
+        elif series["team_1"] != series["team_2"]:
+            box_color = AWAY
+        else:
+            box_color = HOME
+        box_left = max(0, int(series[f"left_{player_id}"]) - left)
+        box_right = max(min(img.shape[1], int(series[f"left_{player_id}"] + series[f"width_{player_id}"]) - left), 0)
+        box_top = max(0, int(series[f"top_{player_id}"]) - down)
+        box_down = max(min(img.shape[0], int(series[f"top_{player_id}"] + series[f"height_{player_id}"]) - down), 0)
+        cv2.rectangle(
+            img_filter,
+            (box_left, box_top),
+            (box_right, box_down),
+            box_color,
+            thickness=-1,
+        )
+
+    img = cv2.addWeighted(src1=img, alpha=0.1, src2=img_filter, beta=0.9, gamma=0)
+    return cv2.resize(img, dsize=output_size)
+
+
+def load_frames(video_path=None):
+    if video_path is None or not os.path.isfile(video_path):
+        np.random.seed(0)
+        return [np.random.randint(0, 256, (frame_size[1], frame_size[0], 3), dtype=np.uint8) for _ in range(n_frames)]
+    vidcap = cv2.VideoCapture(video_path)
+    imgs = []
+    for _ in range(n_frames):
+        it_worked, img = vidcap.read()
+        if not it_worked:
+            break
+        imgs.append(cv2.resize(img, dsize=frame_size))
+    vidcap.release()
+    return imgs
+
+
+def make_pairs():
+    np.random.seed(1)
+    rows = []
+    for i in range(n_pairs):
+        width = np.random.uniform(15, 40, 2)
+        height = width * np.random.uniform(0.9, 1.2, 2)
+        left = np.random.uniform(0, frame_size[0] - 40, 2)
+        top = np.random.uniform(0, frame_size[1] - 40, 2)
+        is_g = i % 5 == 0
+        row = {
+            "nfl_player_id_1": str(40000 + i),
+            "nfl_player_id_2": "G" if is_g else str(50000 + i),
+            "left_1": left[0], "top_1": top[0], "width_1": width[0], "height_1": height[0], "team_1": "h",
+            "left_2": np.nan if is_g else left[1], "top_2": top[1], "width_2": width[1], "height_2": height[1],
+            "team_2": "h" if i % 2 else "v",
+        }
+        n = 1 if is_g else 2
+        row["x"] = np.mean([row[f"left_{j}"] + row[f"width_{j}"] / 2 for j in range(1, n + 1)])
+        row["y"] = np.mean([row[f"top_{j}"] + row[f"height_{j}"] / 2 for j in range(1, n + 1)])
+        row["bbox_size"] = np.mean(np.concatenate([width[:n], height[:n]]))
+        rows.append(pd.Series(row))
+    return rows
+
+
+def bench(func, imgs, pairs):
+    start = time.perf_counter()
+    for img_ in imgs:
+        for series in pairs:
+            func(img_, series)
+    return len(imgs) * len(pairs) / (time.perf_counter() - start)
+
+
+def main():
+    video_path = sys.argv[1] if len(sys.argv) > 1 else None
+    imgs = load_frames(video_path)
+    pairs = make_pairs()
+
+    for img_ in imgs:
+        for series in pairs:
+            legacy = cv2.imencode(".jpg", render_pair_crop_legacy(img_, series))[1]
+            roi = cv2.imencode(".jpg", render_pair_crop(img_, series, output_size=output_size))[1]
+            assert legacy.tobytes() == roi.tobytes()
+    print(f"byte-identical jpg: {len(imgs) * len(pairs)} crops")
+
+    legacy = bench(render_pair_crop_legacy, imgs, pairs)
+    roi = bench(lambda img_, series: render_pair_crop(img_, series, output_size=output_size), imgs, pairs)
+    print(f"frame {frame_size[0]}x{frame_size[1]}, {len(pairs)} pairs/frame")
+    print(f"legacy (full frame copy): {legacy:.0f} renders/sec")
+    print(f"roi first:                {roi:.0f} renders/sec ({roi / legacy:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 
 import pandas as pd
 import numpy as np
-import cv2
-import tqdm
+import os
+import sys
+import json
+import hashlib
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "experiments"))
+from common.frames import write_frames
+from common.jobs import run_resumable
 
 VIDEO_FPS = 25
 VIDEO_LENGTH = 60*120
@@ -18,6 +23,16 @@ tolerances = {
     "throwin": [0.15, 0.20, 0.25, 0.30, 0.35],
 }
 
+# frames stored per video: inside the start / end ranges of the labels +- margin_frames
+margin_frames = 25
+# stored frames: common.frames.FrameStore(output_dir).get_frames(video_id, "frames", frame_indices)
+codec = "jpg"
+scale = 1.0  # 0.5: 960x540
+chunk_size = 32
+
+n_jobs = 4
+n_writers = 2
+
 
 def get_label_ary(df, fps=VIDEO_FPS, video_sec=VIDEO_LENGTH):
     df["group"] = (df["event"] == "start").cumsum()
@@ -47,37 +62,56 @@ def get_label_ary(df, fps=VIDEO_FPS, video_sec=VIDEO_LENGTH):
     return label_ary
 
 
-def extract_image(base_dir, output_dir, video_id, labels):
-    filename = f"{base_dir}/{video_id}.mp4"
-    cap_file = cv2.VideoCapture(filename)
-    frame_count = int(cap_file.get(cv2.CAP_PROP_FRAME_COUNT))
+def get_label_frames(labels, margin=margin_frames):
+    """
+    frame indices inside a labeled start / end range, extended by `margin` frames on both sides.
+    """
+    in_range = (labels >= 0).all(axis=1)
+    if margin > 0:
+        in_range = np.convolve(in_range, np.ones(2 * margin + 1), mode="same") > 0
+    return np.where(in_range)[0]
+
 
-    for frame_index in tqdm.tqdm(range(frame_count)):
-        ret, frame = cap_file.read()
-        # frame = cv2.resize(frame, frame_size)
-        # frame = frame.transpose(2, 0, 1)  # (H, W, C) -> (C, H, W)
-        # if labels[frame_index, 0] >= 0 and labels[frame_index, 1] >= 0 and labels[frame_index, 2] >= 0:
-        cv2.imwrite(f"{output_dir}/{video_id}_frame_{frame_index}.jpg", frame)
+def extract_image(base_dir, output_dir, video_id, frames):
+    return write_frames(
+        f"{base_dir}/{video_id}.mp4",
+        f"{output_dir}/{video_id}/frames",
+        frames=frames,
+        codec=codec,
+        chunk_size=chunk_size,
+        scale=scale,
+        n_writers=n_writers,
+    )
 
 
 def main():
     input_dir = '../../data/dfl-bundesliga-data-shootout'
     df = pd.read_csv(f'{input_dir}/train.csv')
     base_dir = "../../data/dfl-bundesliga-data-shootout/train"
-    output_dir = "../../data/npy/1920x1080"
-
+    output_dir = "../../data/frames/1920x1080"
+
+    input_hash = hashlib.md5(json.dumps({
+        "margin_frames": margin_frames,
+        "codec": codec,
+        "scale": scale,
+        "chunk_size": chunk_size,
+    }).encode()).hexdigest()
+    jobs = {}
     for video_id, w_df in df.groupby("video_id"):
         labels = get_label_ary(w_df)
-        np.save(f"{output_dir}/{video_id}_label.npy", labels)
-        extract_image(base_dir=base_dir,
-                      output_dir=output_dir,
-                      video_id=video_id,
-                      labels=labels)
-
-
-if __name__ == "__main__":
-    main()
+        os.makedirs(f"{output_dir}/{video_id}", exist_ok=True)
+        np.save(f"{output_dir}/{video_id}/label.npy", labels)
+        frames = get_label_frames(labels)
+        jobs[video_id] = (input_hash, (base_dir, output_dir, video_id, frames))
 
+    manifest = run_resumable(extract_image, jobs, output_dir, n_jobs=n_jobs)
 
+    stats = pd.DataFrame([manifest[unit] for unit in jobs.keys() if unit in manifest])
+    if len(stats) > 0:
+        print(f"needed / frames: {stats['n_needed'].sum() / max(1, stats['n_frames'].sum()):.3f}")
+        print(f"decoded / needed: {stats['n_decoded'].sum() / max(1, stats['n_needed'].sum()):.3f}")
+        print(f"frames / sec (per worker): {stats['n_images'].sum() / max(1e-6, stats['elapsed'].sum()):.1f}")
 
 
+if __name__ == "__main__":
+    main()